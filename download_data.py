@@ -1,53 +1,110 @@
 from ecmwf.opendata import Client
+from concurrent.futures import ThreadPoolExecutor
 import os
+import re
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotting'))
+import inputs
+import grib_index
 
-client = Client(source="ecmwf")
-
-folder = os.getenv('MODEL_DATA_FOLDER')
-date = sys.argv[1]
-time = sys.argv[2]
-
-if time in ['00', '12']:
-    steps = list(range(3, 145, 3)) + list(range(150, 241, 6))
-elif time in ['06', '18']:
-    steps = list(range(3, 91, 3))
-
-client.retrieve(
-    type="fc",
-    date=date,
-    time=time,
-    param=['2t','tp','10u','10v','msl','tcwv'],
-    target=f"{folder}/vars_2D.grib2",
-    step=steps,
-)
-
-client.retrieve(
-    type="fc",
-    param=['t','d','r','vo'],
-    date=date,
-    time=time,
-    levelist=850,
-    target=f"{folder}/vars_3D_850.grib2",
-    step=steps,
-)
-
-client.retrieve(
-    type="fc",
-    param=['gh','t'],
-    date=date,
-    time=time,
-    levelist=500,
-    target=f"{folder}/vars_3D_500.grib2",
-    step=steps,
-)
-
-client.retrieve(
-    type="fc",
-    param=['u','v','gh'],
-    date=date,
-    time=time,
-    levelist=250,
-    target=f"{folder}/vars_3D_250.grib2",
-    step=steps,
-)
+# Server to download from: "ecmwf" or the URL of a mirror
+source = os.getenv('OPENDATA_SOURCE', 'ecmwf')
+
+# Parameters of the open data whose name in the files (cfgrib) is different
+params = {'t2m': '2t', 'u10': '10u', 'v10': '10v'}
+
+
+def required_variables():
+    """Variables (names from the catalogue, e.g. t2m, gh_500) needed by the
+    configured products and scripts, see plotting/inputs.py"""
+    return inputs.required_variables()
+
+
+def merge_requests(variables):
+    """Fewest requests (file name -> request) that download the variables:
+    one for all the surface parameters, and the ones on pressure levels either
+    grouped by level or by the set of levels of every parameter, whichever is
+    fewer. A parameter needed at several levels is requested only once for each."""
+    surface, levels = set(), {}
+    for variable in variables:
+        match = re.match(r'^(\w+)_(\d+)$', variable)
+        if match:
+            levels.setdefault(match.group(1), set()).add(int(match.group(2)))
+        else:
+            surface.add(params.get(variable, variable))
+
+    by_level, by_levels = {}, {}
+    for param, param_levels in levels.items():
+        for level in param_levels:
+            by_level.setdefault((level,), set()).add(param)
+        by_levels.setdefault(tuple(sorted(param_levels, reverse=True)), set()).add(param)
+    grouped = by_level if len(by_level) <= len(by_levels) else by_levels
+
+    requests = {}
+    if surface:
+        requests['vars_2D'] = dict(param=sorted(surface))
+    for group, group_params in sorted(grouped.items(), reverse=True):
+        requests['vars_3D_' + '_'.join(str(level) for level in group)] = dict(
+            param=sorted(group_params), levelist=list(group))
+
+    return requests
+
+
+def get_steps(time):
+    """Forecast steps of the run at time (00, 06, 12, 18)"""
+    if time in ['00', '12']:
+        return list(range(3, 145, 3)) + list(range(150, 241, 6))
+    elif time in ['06', '18']:
+        return list(range(3, 91, 3))
+
+
+def get_folder():
+    folder = os.getenv('MODEL_DATA_FOLDER')
+    # Every run is downloaded into its own folder (see utils.run_id)
+    if os.getenv('RUN_ID'):
+        folder = os.path.join(folder, 'runs', os.getenv('RUN_ID'))
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def download(date, time, steps, folder, append=False):
+    """Download steps into the files and write their message index. If append
+    the steps are added to the files that are already there, e.g. when
+    downloading the steps as they are published (see watcher.py).
+    The requests are sent at the same time, each one with its own client."""
+    files = merge_requests(required_variables())
+
+    def retrieve(name):
+        target = f"{folder}/{name}.grib2"
+        result = Client(source=source).retrieve(
+            type="fc",
+            date=date,
+            time=time,
+            target=f"{folder}/{name}.part.grib2" if append else target,
+            step=steps,
+            **files[name],
+        )
+        if append:
+            grib_index.append(target, f"{folder}/{name}.part.grib2")
+            os.remove(f"{folder}/{name}.part.grib2")
+        else:
+            grib_index.build_index(target)
+        return result
+
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        results = dict(zip(files, executor.map(retrieve, files)))
+
+    for name, result in results.items():
+        print('%s : %s %s, %d files, %.1f MB' % (os.path.basename(sys.argv[0]), name,
+                                                 ','.join(files[name]['param']), len(result.urls),
+                                                 (result.size or 0) / 1e6))
+    print('%s : %d requests, %d files, %.1f MB for %d steps' % (
+        os.path.basename(sys.argv[0]), len(results),
+        sum(len(result.urls) for result in results.values()),
+        sum(result.size or 0 for result in results.values()) / 1e6, len(steps)))
+
+
+if __name__ == "__main__":
+    date = sys.argv[1]
+    time = sys.argv[2]
+    download(date, time, get_steps(time), get_folder())
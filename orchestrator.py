@@ -0,0 +1,439 @@
+"""Run the processing of a run as a graph of tasks instead of the sequential
+sections of copy_data.sh:
+
+    download -> decode -> [ingest] -> render (script x projection) -> upload (product x projection)
+                       -> tiles (projection)                                    -> [archive] -> cleanup
+
+Every task starts as soon as its dependencies are done, with a limit on how
+many tasks of the same stage run at the same time, so that e.g. the upload of a
+product starts while the other products are still being rendered.
+The run is the latest one whose steps are all available on the server, unless
+given explicitly. At the end a report with the critical path is written
+to runs/<RUN_ID>/report.json.
+
+Usage: python orchestrator.py [YYYYMMDDHH]
+
+The stages can be turned off with the same toggles of copy_data.sh, e.g.
+DATA_UPLOAD=false. With POINTS_FILE set the time series at those points are
+extracted as well."""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from glob import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+home_folder = os.path.dirname(os.path.abspath(__file__))
+folder = os.environ['MODEL_DATA_FOLDER']
+sys.path.append(os.path.join(home_folder, 'plotting'))
+import events
+
+# Maximum number of tasks of every stage running at the same time
+concurrency = {
+    'download': 1,
+    'decode': 1,
+    'ingest': 1,
+    'render': 4,
+    'tiles': 3,
+    'points': 1,
+    'upload': 5,
+    'cleanup': 1,
+}
+
+# Memory in MB that the render tasks running at the same time may use according
+# to the estimates of the decode step (see plotting/compute_stats.py), i.e. for
+# their data besides the interpreters: a render task waits, besides its slot,
+# until its estimate fits. 0 disables the check.
+memory_budget = float(os.environ.get('RENDER_MEMORY_BUDGET', 0))
+
+# Plotting scripts and the product they produce
+scripts = {
+    'plot_jetstream.py': 'winds_jet',
+    'plot_rain_acc.py': 'precip_acc',
+    'plot_precip_3h.py': 'precip_3h',
+    'plot_precip_6h.py': 'precip_6h',
+    'plot_precip_24h.py': 'precip_24h',
+    'plot_geop_500.py': 'gph_500',
+    'plot_mslp_wind.py': 'winds10m',
+    'plot_pres_t2m_wind.py': 't_v_pres',
+}
+
+# Comparisons with the previous run, which need the archive of the decoded
+# stores (see plotting/archive.py) and so the ingest
+diff_scripts = {
+    'plot_msl_diff.py': 'msl_diff',
+    'plot_t2m_diff.py': 't2m_diff',
+}
+
+# Projections and the remote folder where their images are uploaded
+projections = {
+    'euratl': 'ecmwf_euratl',
+    'nh': 'ecmwf_globe',
+    'nh_polar': 'ecmwf_nh_polar',
+    'us': 'ecmwf_us',
+    'world': 'ecmwf_world',
+    'it': 'ecmwf_it',
+    'de': 'ecmwf_de',
+}
+
+tiles_projections = ['euratl', 'it', 'de']
+
+# Number of runs to keep besides the ones still referenced by published/
+runs_to_keep = 2
+
+
+def print_message(message, **fields):
+    """Formatted print, also written to the event log with fields when enabled
+    (see plotting/events.py)"""
+    print(os.path.basename(sys.argv[0]) + ' : ' + message, flush=True)
+    events.log(message, **fields)
+
+
+def toggle(name, default=True):
+    if name in os.environ:
+        return os.environ[name].lower() in ['1', 'true', 'yes']
+    return default
+
+
+def latest_complete_run():
+    """Latest run whose last step is already available, asking the server
+    instead of guessing from the current hour"""
+    from ecmwf.opendata import Client
+    client = Client(source="ecmwf")
+    # The 06/18 runs stop at 90 hours, the 00/12 ones at 240 hours
+    latest_90 = client.latest(type="fc", step=90, param="msl")
+    if latest_90.hour in [6, 18]:
+        return latest_90
+    # A 00/12 run with step 90 may still be incomplete: the previous
+    # 06/18 run is surely complete, use it unless this one is
+    latest_240 = client.latest(type="fc", step=240, param="msl")
+
+    return max(latest_240, latest_90 - timedelta(hours=6))
+
+
+def build_tasks(run, run_folder, complete=True):
+    """Graph of the tasks of a run: name -> stage, command and dependencies.
+    complete is False while only some steps of the run are processed (see
+    watcher.py), so that the run is archived only once, with all its steps."""
+    tasks = {}
+    plotting = toggle('DATA_PLOTTING')
+    run_scripts = dict(scripts, **diff_scripts) if toggle('DECODED_STORE', default=False) else scripts
+    if toggle('DATA_DOWNLOAD'):
+        tasks['download'] = dict(stage='download', deps=[], cwd=home_folder,
+                                 command=['python', 'download_data.py',
+                                          run.strftime('%Y%m%d'), run.strftime('%H')])
+    if plotting:
+        # Message index -> catalogue -> run statistics
+        tasks['decode'] = dict(stage='decode', deps=[t for t in ['download'] if t in tasks],
+                               cwd=home_folder + '/plotting',
+                               command=['python', 'compute_stats.py'])
+        render_deps = ['decode']
+        if toggle('DECODED_STORE', default=False):
+            # Decoded fields at several resolutions, read by the render tasks
+            tasks['ingest'] = dict(stage='ingest', deps=['decode'], cwd=home_folder + '/plotting',
+                                   command=['python', 'ingest.py'])
+            render_deps.append('ingest')
+        for script in run_scripts:
+            for projection in projections:
+                name = 'render:%s:%s' % (run_scripts[script], projection)
+                command = ['python', script, projection]
+                if toggle('RENDER_DAEMON', default=False):
+                    # Run by the warm workers of plotting/render_daemon.py, which must be running
+                    command = ['python', 'render_daemon.py', 'submit', script, projection,
+                               run_folder + 'logs/' + name.replace(':', '_') + '.log']
+                tasks[name] = dict(stage='render', deps=render_deps,
+                                   cwd=home_folder + '/plotting', command=command,
+                                   memory=memory_estimate(run_folder, run_scripts[script], projection))
+        if toggle('DATA_TILES', default=False):
+            for projection in tiles_projections:
+                tasks['tiles:%s' % projection] = dict(
+                    stage='tiles', deps=['decode'], cwd=home_folder + '/plotting',
+                    command=['python', 'plot_tiles.py', projection])
+        if os.environ.get('POINTS_FILE'):
+            # Time series at the points of POINTS_FILE, see plotting/meteograms.py
+            tasks['points'] = dict(stage='points', deps=['decode'], cwd=home_folder + '/plotting',
+                                   command=['python', 'meteograms.py', os.environ['POINTS_FILE']])
+    if toggle('DATA_UPLOAD'):
+        for product in run_scripts.values():
+            for projection, remote in projections.items():
+                render = 'render:%s:%s' % (product, projection)
+                tasks['upload:%s:%s' % (product, projection)] = dict(
+                    stage='upload', deps=[render] if render in tasks else [],
+                    command=upload_command(product, projection, remote))
+    if complete and 'ingest' in tasks:
+        # Decoded store of the run, kept for the comparisons with the next runs
+        tasks['archive'] = dict(stage='cleanup', deps=['ingest'] + [t for t in tasks if t.startswith('render:')],
+                                cwd=home_folder + '/plotting', command=['python', 'archive.py'])
+    # Last one, whatever the result of the others
+    tasks['cleanup'] = dict(stage='cleanup', deps=list(tasks), always=True,
+                            function=cleanup_runs)
+
+    return tasks
+
+
+def upload_command(product, projection, remote):
+    """ncftpput of the published images of a product. The files are listed
+    when the task starts, i.e. after the product has been rendered."""
+    def command():
+        local = folder + 'published/%s/%s/' % (projection, product)
+        if os.environ.get('ANIMATION_OUTPUT'):
+            files = glob(local + product + '_anim.*') + glob(local + product + '_sprite.*')
+        else:
+            files = glob(local + product + '_*')
+        return ['ncftpput', '-R', '-v', '-DD', '-m', os.environ.get('NCFTP_BOOKMARK', 'mid'),
+                '%s/%s' % (remote, product)] + sorted(files)
+    return command
+
+
+def memory_estimate(run_folder, product, projection):
+    """Estimated memory (MB) of rendering a product, read when the task is
+    ready, i.e. once the decode step has written run_stats.json"""
+    def estimate():
+        try:
+            with open(run_folder + 'run_stats.json', 'r') as f:
+                memory = json.load(f)['memory']
+        except (OSError, ValueError, KeyError):
+            return 0.
+        return memory.get(product, {}).get(projection, memory['default'])
+    return estimate
+
+
+def cleanup_runs():
+    """Remove the older runs, but never one that a published product still points to"""
+    referenced = set()
+    for root, dirs, files in os.walk(folder + 'published'):
+        for name in dirs + files:
+            if os.path.islink(os.path.join(root, name)):
+                referenced.add(os.readlink(os.path.join(root, name)))
+    runs = sorted(glob(folder + 'runs/*/'))
+    for run_folder in runs[:-runs_to_keep]:
+        if not any(target.startswith(os.path.abspath(run_folder)) for target in referenced):
+            print_message('Removing old run ' + run_folder)
+            shutil.rmtree(run_folder)
+
+
+def execute(name, task, env, log_folder):
+    """Run a single task, returning its start and end time and exit code"""
+    start = time.time()
+    if 'function' in task:
+        try:
+            task['function']()
+            returncode = 0
+        except Exception as e:
+            print_message('%s failed: %s' % (name, e))
+            returncode = 1
+    else:
+        command = task['command']() if callable(task['command']) else task['command']
+        with open(log_folder + name.replace(':', '_') + '.log', 'a') as log:
+            returncode = subprocess.call(command, cwd=task.get('cwd'), env=env,
+                                         stdout=log, stderr=subprocess.STDOUT)
+
+    return start, time.time(), returncode
+
+
+# Metrics of the admission of the tasks in the last run_graph: memory budget,
+# peak of the estimates of the tasks running together, tasks delayed by the
+# budget and largest number of tasks ready but waiting for a slot or memory
+admission = {}
+
+
+def run_graph(tasks, env, log_folder):
+    """Execute the tasks respecting the dependencies and the concurrency
+    limits of every stage. When a task fails the tasks depending on it
+    are skipped, all the others still run."""
+    results, running = {}, {}
+    pending = dict(tasks)
+    # When every task became ready to start
+    ready = {}
+    admission.clear()
+    admission.update(budget=memory_budget, peak=0., delayed=[], queue_max=0)
+    with ThreadPoolExecutor(max_workers=sum(concurrency.values())) as executor:
+        while pending or running:
+            for name, task in list(pending.items()):
+                if not task.get('always') and \
+                        any(results.get(dep, {}).get('status') in ['failed', 'skipped']
+                            for dep in task['deps']):
+                    results[name] = {'stage': task['stage'], 'status': 'skipped'}
+                    print_message('%s skipped' % name)
+                    del pending[name]
+                    continue
+                if not all(dep in results for dep in task['deps']):
+                    continue
+                ready.setdefault(name, time.time())
+                if sum(1 for n in running.values() if tasks[n]['stage'] == task['stage']) \
+                        >= concurrency[task['stage']]:
+                    continue
+                if memory_budget and 'memory' in task:
+                    if callable(task['memory']):
+                        task['memory'] = task['memory']()
+                    in_use = sum(tasks[n].get('memory', 0.) for n in running.values())
+                    # A task larger than the budget still runs, but alone
+                    if in_use and in_use + task['memory'] > memory_budget:
+                        if name not in admission['delayed']:
+                            admission['delayed'].append(name)
+                        continue
+                    admission['peak'] = max(admission['peak'], in_use + task['memory'])
+                running[executor.submit(execute, name, task, env, log_folder)] = name
+                del pending[name]
+                events.log('start', task=name, stage=task['stage'], wait=round(time.time() - ready[name], 3),
+                           queued=sum(1 for n in pending if n in ready))
+            admission['queue_max'] = max(admission['queue_max'],
+                                         sum(1 for name in pending if name in ready))
+            if not running:
+                # Nothing left that can start
+                for name, task in pending.items():
+                    results[name] = {'stage': task['stage'], 'status': 'skipped'}
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                start, end, returncode = future.result()
+                results[name] = {'stage': tasks[name]['stage'], 'deps': tasks[name]['deps'],
+                                 'start': start, 'end': end, 'wait': start - ready[name],
+                                 'status': 'ok' if returncode == 0 else 'failed'}
+                if not callable(tasks[name].get('memory')) and 'memory' in tasks[name]:
+                    results[name]['memory'] = tasks[name]['memory']
+                print_message('%s %s in %.1fs' % (name, results[name]['status'], end - start),
+                              task=name, stage=tasks[name]['stage'], status=results[name]['status'],
+                              duration=round(end - start, 3), wait=round(results[name]['wait'], 3))
+
+    return results
+
+
+def critical_path(results):
+    """Chain of tasks that determined the duration of the run: starting from
+    the last task to finish, go back to whatever it was waiting for, i.e. the
+    dependency that finished last or, if it was waiting for a free slot,
+    the task of the same stage that released it"""
+    done = {name: r for name, r in results.items() if 'end' in r}
+    if not done:
+        return []
+    name = max(done, key=lambda n: done[n]['end'])
+    path = []
+    while name is not None:
+        path.append(name)
+        candidates = [n for n in done if n != name and n not in path and
+                      done[n]['end'] <= done[name]['start'] + 0.5 and
+                      (n in done[name]['deps'] or done[n]['stage'] == done[name]['stage'])]
+        name = max(candidates, key=lambda n: done[n]['end']) if candidates else None
+
+    return path[::-1]
+
+
+def write_report(results, run_folder, start):
+    path = critical_path(results)
+    report = {
+        'elapsed': time.time() - start,
+        'critical_path': [{'task': name,
+                           'start': results[name]['start'] - start,
+                           'duration': results[name]['end'] - results[name]['start']}
+                          for name in path],
+        'stages': {},
+        'admission': admission,
+        'tasks': results,
+    }
+    for result in results.values():
+        stage = report['stages'].setdefault(result['stage'], {'ok': 0, 'failed': 0, 'skipped': 0,
+                                                                'busy': 0., 'wait': 0., 'wait_max': 0.})
+        stage[result['status']] += 1
+        if 'end' in result:
+            stage['busy'] += result['end'] - result['start']
+            stage['wait'] += result['wait']
+            stage['wait_max'] = max(stage['wait_max'], result['wait'])
+    with open(run_folder + 'report.json', 'w') as f:
+        json.dump(report, f, indent=1)
+    if os.environ.get('METRICS_TEXTFILE'):
+        write_metrics(report, run_folder, os.environ['METRICS_TEXTFILE'])
+
+    print_message('Critical path (%.1fs total):' % report['elapsed'], duration=round(report['elapsed'], 3))
+    for item in report['critical_path']:
+        print_message('  %-35s at %7.1fs for %7.1fs' % (item['task'], item['start'], item['duration']))
+    for stage, counts in report['stages'].items():
+        print_message('  %-10s %3d ok %3d failed %3d skipped, %.1fs busy, %.1fs waiting (max %.1fs)' %
+                      (stage, counts['ok'], counts['failed'], counts['skipped'], counts['busy'],
+                       counts['wait'], counts['wait_max']),
+                      stage=stage, duration=round(counts['busy'], 3), wait=round(counts['wait'], 3))
+    if admission.get('budget'):
+        print_message('Memory budget %.0f MB: peak estimate %.0f MB, %d tasks delayed, up to %d tasks queued' %
+                      (admission['budget'], admission['peak'], len(admission['delayed']),
+                       admission['queue_max']))
+
+    return report
+
+
+def write_metrics(report, run_folder, path):
+    """Metrics of the run in the Prometheus text format for the textfile collector:
+    duration, tasks, time busy and waiting of every stage, admission and, from
+    the event log, the frames drawn by every render task"""
+    stages = report['stages']
+    metrics = {
+        'run_duration_seconds': ('gauge', 'Duration of the last run', [({}, report['elapsed'])]),
+        'run_end_timestamp_seconds': ('gauge', 'End of the last run', [({}, time.time())]),
+        'stage_tasks': ('gauge', 'Tasks of every stage by status',
+                        [({'stage': stage, 'status': status}, counts[status])
+                         for stage, counts in stages.items() for status in ['ok', 'failed', 'skipped']]),
+        'stage_busy_seconds': ('gauge', 'Time spent running the tasks of every stage',
+                               [({'stage': stage}, counts['busy']) for stage, counts in stages.items()]),
+        'stage_wait_seconds': ('gauge', 'Time the tasks of every stage waited once ready',
+                               [({'stage': stage}, counts['wait']) for stage, counts in stages.items()]),
+        'stage_wait_max_seconds': ('gauge', 'Longest wait of a task of every stage once ready',
+                                   [({'stage': stage}, counts['wait_max']) for stage, counts in stages.items()]),
+        'queue_max_tasks': ('gauge', 'Largest number of tasks ready and waiting',
+                            [({}, admission.get('queue_max', 0))]),
+    }
+    if admission.get('budget'):
+        metrics['memory_budget_megabytes'] = ('gauge', 'Memory budget of the render tasks',
+                                              [({}, admission['budget'])])
+        metrics['memory_peak_megabytes'] = ('gauge', 'Peak estimated memory of the render tasks',
+                                            [({}, admission['peak'])])
+        metrics['memory_delayed_tasks'] = ('gauge', 'Tasks delayed by the memory budget',
+                                           [({}, len(admission['delayed']))])
+
+    frames = {}
+    for event in events.read_events(run_folder + 'events.jsonl'):
+        if event.get('message') == 'frame':
+            key = (event.get('product'), event.get('projection'))
+            count, seconds = frames.get(key, (0, 0.))
+            frames[key] = (count + 1, seconds + event.get('duration', 0.))
+    if frames:
+        tasks = report['tasks']
+        metrics['frames'] = ('gauge', 'Frames drawn by every product',
+                             [({'product': p, 'projection': r}, n) for (p, r), (n, _) in frames.items()])
+        metrics['frame_seconds'] = ('gauge', 'Time spent drawing the frames of every product',
+                                    [({'product': p, 'projection': r}, s) for (p, r), (_, s) in frames.items()])
+        metrics['frames_per_second'] = ('gauge', 'Frames of every product per second of its render task',
+                                        [({'product': p, 'projection': r},
+                                          n / (tasks[t]['end'] - tasks[t]['start']))
+                                         for (p, r), (n, _) in frames.items()
+                                         for t in ['render:%s:%s' % (p, r)] if 'end' in tasks.get(t, {})])
+    events.write_metrics(path, metrics)
+
+
+def main():
+    start = time.time()
+    if sys.argv[1:]:
+        run = datetime.strptime(sys.argv[1], '%Y%m%d%H')
+    else:
+        run = latest_complete_run()
+    run_id = run.strftime('%Y%m%d%H')
+    run_folder = folder + 'runs/%s/' % run_id
+    if os.path.isfile(run_folder + 'report.json') and not sys.argv[1:]:
+        print_message('Run %s already processed' % run_id)
+        return 0
+    os.makedirs(run_folder + 'logs', exist_ok=True)
+    if toggle('EVENT_LOG', default=False):
+        events.configure(run_folder + 'events.jsonl', run=run_id, script=os.path.basename(sys.argv[0]))
+    print_message('Processing run %s' % run_id)
+
+    env = dict(os.environ, RUN_ID=run_id, QT_QPA_PLATFORM='offscreen')
+    results = run_graph(build_tasks(run, run_folder), env, run_folder + 'logs/')
+    write_report(results, run_folder, start)
+
+    return int(any(r['status'] != 'ok' for r in results.values()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
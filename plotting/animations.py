@@ -0,0 +1,123 @@
+"""Assemble the frames of a (product, projection) into animations and a sprite.
+The frames are the PNG buffers rendered by the plotting workers (see
+utils.save_figure), so nothing has to be read again from disk unless only
+some of the steps were rendered (see utils.plot_steps).
+The formats to produce are chosen with the ANIMATION_OUTPUT environment
+variable, e.g. ANIMATION_OUTPUT=apng,webp,mp4,sprite"""
+import io
+from glob import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import numpy as np
+from PIL import Image
+import utils
+
+# Duration of every frame in the animations, in milliseconds
+frame_duration = 500
+
+
+def decode_frames(frames):
+    """Decode the (cum_hour, png bytes) frames, sorted by forecast hour.
+    With bbox_inches='tight' the size of the frames can differ by a few pixels,
+    so they are all padded to the largest one."""
+    frames = sorted(frames, key=lambda frame: frame[0])
+    hours = [int(hour) for hour, _ in frames]
+    images = [Image.open(io.BytesIO(png)).convert('RGB') for _, png in frames]
+    width = max(image.width for image in images)
+    height = max(image.height for image in images)
+    padded = []
+    for image in images:
+        if image.size != (width, height):
+            background = Image.new('RGB', (width, height), 'white')
+            background.paste(image, (0, 0))
+            image = background
+        padded.append(image)
+
+    return hours, padded
+
+
+def read_frames(basename, exclude=[]):
+    """(cum_hour, png bytes) of the frames already written to disk"""
+    frames = []
+    for filename in glob(basename + '_*.png'):
+        hour = os.path.basename(filename)[len(os.path.basename(basename)) + 1:-4]
+        if hour.isdigit() and int(hour) not in exclude:
+            with open(filename, 'rb') as f:
+                frames.append((int(hour), f.read()))
+
+    return frames
+
+
+def write_apng(images, filename):
+    images[0].save(filename, format='PNG', save_all=True, append_images=images[1:],
+                   duration=frame_duration, loop=0)
+
+
+def write_webp(images, filename):
+    images[0].save(filename, format='WEBP', save_all=True, append_images=images[1:],
+                   duration=frame_duration, loop=0, quality=90)
+
+
+def write_mp4(images, filename):
+    """Pipe the raw frames to the local ffmpeg encoder"""
+    if shutil.which('ffmpeg') is None:
+        utils.print_message('WARNING: ffmpeg not found, skipping ' + filename)
+        return
+    # yuv420p needs even dimensions
+    width, height = images[0].width // 2 * 2, images[0].height // 2 * 2
+    command = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height),
+               '-framerate', '%.3f' % (1000. / frame_duration), '-i', '-',
+               '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+               filename]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    for image in images:
+        process.stdin.write(np.asarray(image)[:height, :width].tobytes())
+    process.stdin.close()
+    if process.wait() != 0:
+        utils.print_message('WARNING: ffmpeg failed to encode ' + filename)
+
+
+def write_sprite(images, hours, filename_image, filename_index):
+    """Paste all the frames in a single atlas image and write an index
+    with the position of every forecast hour in the atlas"""
+    width, height = images[0].size
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    atlas = Image.new('RGB', (columns * width, rows * height), 'white')
+    index = {'frame_width': width, 'frame_height': height,
+             'columns': columns, 'rows': rows, 'frames': []}
+    for i, (image, hour) in enumerate(zip(images, hours)):
+        x, y = (i % columns) * width, (i // columns) * height
+        atlas.paste(image, (x, y))
+        index['frames'].append({'step': hour, 'x': x, 'y': y})
+    atlas.save(filename_image, format='PNG', optimize=True)
+    with open(filename_index, 'w') as f:
+        json.dump(index, f)
+
+
+def write_outputs(frames, variable_name, projection):
+    """Write all the outputs requested in utils.animation_formats
+    for the frames of a product"""
+    basename = utils.product_folder(projection, variable_name) + '/' + variable_name
+    if utils.plot_steps:
+        # Only some steps were rendered now, the others are read back from disk
+        frames = frames + read_frames(basename, exclude=[hour for hour, _ in frames])
+    if not frames:
+        return
+    hours, images = decode_frames(frames)
+
+    if 'apng' in utils.animation_formats:
+        write_apng(images, basename + '_anim.png')
+    if 'webp' in utils.animation_formats:
+        write_webp(images, basename + '_anim.webp')
+    if 'mp4' in utils.animation_formats:
+        write_mp4(images, basename + '_anim.mp4')
+    if 'sprite' in utils.animation_formats:
+        write_sprite(images, hours, basename + '_sprite.png', basename + '_sprite.json')
+
+    utils.print_message('Written %s outputs for %d frames' %
+                        (','.join(utils.animation_formats), len(images)))
@@ -0,0 +1,123 @@
+"""Decoded stores of the last runs, kept after the run folders (and their GRIB
+files) have been removed, so that a run can be compared with the previous ones
+without downloading them again.
+
+Once the run is complete (the archive task of orchestrator.py, after the ingest
+and the render tasks) the decoded store of the run is copied to
+archive/<run>.zarr in the data folder, and the archive is trimmed to the last
+ARCHIVE_RUNS runs, dropping the ones older than ARCHIVE_MAX_DAYS with respect
+to the latest and then the oldest ones until it's smaller than ARCHIVE_MAX_GB.
+
+The products with a `difference` (see products.py) show the change of some
+fields with respect to the previous archived run at the same valid times:
+read_previous gives the fields of that run matching the steps of the current
+one, and the difference is a single operation on the arrays.
+
+    python archive.py            archive the current run and trim the archive
+    python archive.py list       list the archived runs"""
+import os
+import sys
+import shutil
+from glob import glob
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+import utils
+
+archive_folder = utils.base_folder + 'archive/'
+
+
+def archived_runs():
+    """Runs in the archive (YYYYMMDDHH), oldest first"""
+    return sorted(os.path.basename(path)[:-len('.zarr')]
+                  for path in glob(archive_folder + '*.zarr'))
+
+
+def get_size(path):
+    """Bytes of the files under path"""
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def archive_run():
+    """Copy the decoded store of the run to the archive (replacing a previous
+    copy, as steps can be appended to the store) and trim the archive"""
+    run = xr.open_zarr(utils.decoded_store_file, group='level_0').attrs['run']
+    path = archive_folder + run + '.zarr'
+    os.makedirs(archive_folder, exist_ok=True)
+    # Copied aside and renamed, so that the readers never see half a store
+    shutil.rmtree(path + '.tmp', ignore_errors=True)
+    shutil.copytree(utils.decoded_store_file, path + '.tmp')
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(path + '.tmp', path)
+    utils.print_message('Archived run %s' % run)
+    evict()
+
+
+def evict():
+    """Remove the runs beyond archive_runs, older than archive_max_days before
+    the latest one and then the oldest ones until the archive fits in archive_max_gb"""
+    runs = archived_runs()
+    if not runs:
+        return
+    latest = datetime.strptime(runs[-1], '%Y%m%d%H')
+    evicted = runs[:max(len(runs) - utils.archive_runs, 0)]
+    evicted += [run for run in runs if run not in evicted and
+                (latest - datetime.strptime(run, '%Y%m%d%H')).days >= utils.archive_max_days]
+    kept = [run for run in runs if run not in evicted]
+    sizes = {run: get_size(archive_folder + run + '.zarr') for run in kept}
+    # The latest one is always kept
+    while len(kept) > 1 and sum(sizes[run] for run in kept) > utils.archive_max_gb * 1e9:
+        evicted.append(kept.pop(0))
+    for run in evicted:
+        utils.print_message('Removing run %s from the archive' % run)
+        shutil.rmtree(archive_folder + run + '.zarr')
+
+
+def previous_run(run):
+    """Latest archived run before run, or None"""
+    runs = [r for r in archived_runs() if r < run]
+
+    return runs[-1] if runs else None
+
+
+def read_previous(variables, dset, level=0):
+    """The variables (names from the catalogue) of the previous archived run at
+    the valid times of dset, with the same names and steps. Returns dset and the
+    previous fields, both only at the valid times found in the previous run, or
+    None if there is no previous run in the archive or no valid time in common
+    (e.g. the first run after enabling the decoded store)."""
+    run = pd.to_datetime(dset['time'].values).strftime('%Y%m%d%H')
+    previous = previous_run(run)
+    if previous is None:
+        utils.print_message('No run before %s in the archive %s' % (run, archive_folder))
+        return None
+    utils.print_message('Comparing with the run %s' % previous)
+    prev = xr.open_dataset(archive_folder + previous + '.zarr', engine='zarr',
+                           group='level_%d' % level,
+                           chunks=utils.streaming_chunks() if utils.streaming else None)
+    # Same names as in read_dataset
+    catalogue = utils.get_catalogue()
+    names = [catalogue['variables'][variable]['name'] for variable in variables]
+    prev = prev[variables].rename({variable: name for variable, name in zip(variables, names)
+                                   if names.count(name) == 1})
+
+    prev = prev.swap_dims(step='valid_time').drop_vars(['step', 'time'], errors='ignore')
+    common = np.isin(dset['valid_time'].values, prev['valid_time'].values)
+    if not common.any():
+        utils.print_message('No valid time of run %s is in the run %s' % (run, previous))
+        return None
+    dset = dset.isel(step=np.flatnonzero(common))
+    prev = prev.sel(valid_time=dset['valid_time'].values)
+    prev = prev.rename(valid_time='step').assign_coords(step=dset['step'].values)
+
+    return dset, prev
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['list']:
+        for run in archived_runs():
+            utils.print_message('%s %.1f MB' % (run, get_size(archive_folder + run + '.zarr') / 1e6))
+    else:
+        archive_run()
@@ -0,0 +1,223 @@
+"""Benchmarks for the plotting optimisations. They run on the data
+that is currently in the data folder, e.g.
+
+    python benchmark.py contours euratl nh world
+
+`frames` exits with an error when the time or memory per frame trends upward,
+so that it can be run after every change of the plotting loops."""
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import xarray as xr
+import sys
+import time
+import utils
+import contours
+import raster
+import labels
+import profiling
+import render
+from products import products
+import io
+from PIL import Image
+from computations import compute_wind_speed
+
+
+def bench_contours(projections):
+    """Contour MSLP for every projection and step, comparing ax.contour
+    against projecting the paths cached in lon/lat space"""
+    dset = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
+                           backend_kwargs={'filter_by_keys': {'shortName': 'msl'}})
+    dset['msl'] = dset['msl'].metpy.convert_units('hPa').metpy.dequantify()
+    dset = dset.load()
+    levels_mslp = np.arange(dset['msl'].min().astype("int"),
+                            dset['msl'].max().astype("int"), 5.)
+
+    start = time.perf_counter()
+    contours.precompute(dset['msl'], 'msl', levels_mslp)
+    elapsed_precompute = time.perf_counter() - start
+
+    elapsed_contour, elapsed_cached = 0., 0.
+    for projection in projections:
+        _ = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
+        ax = plt.gca()
+        m, x, y, mask = utils.get_projection(dset, projection)
+        dset_proj = dset.where(mask, drop=True)
+        for step in dset_proj.step:
+            data = dset_proj['msl'].sel(step=step)
+            _, run, cum_hour = utils.get_time_run_cum(data)
+
+            start = time.perf_counter()
+            c = ax.contour(x, y, data, levels=levels_mslp,
+                           colors='black', linewidths=0.5)
+            elapsed_contour += time.perf_counter() - start
+            utils.remove_collections([c])
+
+            start = time.perf_counter()
+            allsegs = contours.load('msl', run, cum_hour, levels_mslp)
+            c = contours.ContourSet(ax, levels_mslp,
+                                    contours.project_contours(m, allsegs),
+                                    colors='black', linewidths=0.5)
+            elapsed_cached += time.perf_counter() - start
+            utils.remove_collections([c])
+        plt.close('all')
+
+    utils.print_message('contours: %d projections x %d steps' %
+                        (len(projections), len(dset.step)))
+    utils.print_message('contours: ax.contour %.2fs, cached %.2fs + precompute %.2fs (once per run)' %
+                        (elapsed_contour, elapsed_cached, elapsed_precompute))
+
+
+def render_to_array(fig):
+    """Draw fig and return the RGB pixels, as they would be saved"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=utils.options_savefig['dpi'])
+    return np.asarray(Image.open(buffer).convert('RGB')).astype(int)
+
+
+def bench_raster(projections):
+    """Draw the 10m wind speed with contourf and with the raster lookup table
+    for every projection and step, comparing the time to draw and save the frame
+    and the fraction of pixels that differ between the two"""
+    dset = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
+                           backend_kwargs={'filter_by_keys': {'typeOfLevel': 'heightAboveGround', 'level': 10}})
+    dset = compute_wind_speed(dset, uvar='u10', vvar='v10').load()
+    levels = np.linspace(0, 150., 178)
+    cmap, norm = utils.get_colormap_norm('winds_wxcharts', levels=levels)
+    lut = raster.build_lut(levels, cmap, norm, extend='max')
+
+    for projection in projections:
+        fig = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
+        ax = plt.gca()
+        m, x, y, mask = utils.get_projection(dset, projection)
+        dset_proj = dset.where(mask, drop=True)
+        start = time.perf_counter()
+        index = raster.get_projection_index(projection, m, ax,
+                                            dset_proj['longitude'].values,
+                                            dset_proj['latitude'].values)
+        elapsed_index = time.perf_counter() - start
+        elapsed_contourf, elapsed_raster, differences = 0., 0., []
+        for step in dset_proj.step:
+            data = dset_proj['wind_speed'].sel(step=step)
+
+            start = time.perf_counter()
+            cs = ax.contourf(x, y, data, extend='max', cmap=cmap, norm=norm, levels=levels)
+            pixels_contourf = render_to_array(fig)
+            elapsed_contourf += time.perf_counter() - start
+            utils.remove_collections([cs])
+
+            start = time.perf_counter()
+            cs = raster.render(ax, m, data, index, levels, lut)
+            pixels_raster = render_to_array(fig)
+            elapsed_raster += time.perf_counter() - start
+            utils.remove_collections([cs])
+
+            differences.append(
+                (np.abs(pixels_contourf - pixels_raster).max(axis=-1) > 16).mean())
+        plt.close('all')
+
+        utils.print_message('raster %s: contourf %.2fs, raster %.2fs + index %.2fs (cached), '
+                            '%.1f%% of pixels differ' %
+                            (projection, elapsed_contourf, elapsed_raster, elapsed_index,
+                             100 * np.mean(differences)))
+
+
+def bench_labels(projections):
+    """Label the MSLP contours with ax.clabel and with labels.clabel for every
+    projection and step, comparing the time per frame (labels and saving)
+    and the number of labels"""
+    dset = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
+                           backend_kwargs={'filter_by_keys': {'shortName': 'msl'}})
+    dset['msl'] = dset['msl'].metpy.convert_units('hPa').metpy.dequantify()
+    dset = dset.load()
+    levels_mslp = np.arange(dset['msl'].min().astype("int"),
+                            dset['msl'].max().astype("int"), 4.)
+
+    for projection in projections:
+        fig = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
+        ax = plt.gca()
+        m, x, y, mask = utils.get_projection(dset, projection)
+        dset_proj = dset.where(mask, drop=True)
+        elapsed_clabel, elapsed_fast, count_clabel, count_fast = 0., 0., 0, 0
+        for step in dset_proj.step:
+            c = ax.contour(x, y, dset_proj['msl'].sel(step=step), levels=levels_mslp,
+                           colors='black', linewidths=0.5)
+
+            start = time.perf_counter()
+            texts = ax.clabel(c, c.levels, inline=True, fmt='%4.0f', fontsize=6)
+            render_to_array(fig)
+            elapsed_clabel += time.perf_counter() - start
+            count_clabel += len(texts)
+            # Removes the labels as well
+            utils.remove_collections([c])
+
+            c = ax.contour(x, y, dset_proj['msl'].sel(step=step), levels=levels_mslp,
+                           colors='black', linewidths=0.5)
+            start = time.perf_counter()
+            collection = labels.clabel(ax, c, 'msl', fmt='%4.0f', fontsize=6)
+            render_to_array(fig)
+            elapsed_fast += time.perf_counter() - start
+            count_fast += len(collection.get_paths())
+            utils.remove_collections([collection, c])
+        plt.close('all')
+
+        steps = len(dset_proj.step)
+        utils.print_message('labels %s: clabel %.3fs/frame (%.1f labels), '
+                            'fast %.3fs/frame (%.1f labels)' %
+                            (projection, elapsed_clabel / steps, count_clabel / steps,
+                             elapsed_fast / steps, count_fast / steps))
+
+
+def bench_frames(projections):
+    """Draw every product for every projection in a single process with the
+    profiling of the frames enabled (see profiling.py), failing if the time or
+    memory per frame grows along the loop or artists are left on the axes"""
+    utils.profile_frames = True
+    if utils.plot_steps:
+        steps = set.union(*[set(entry['steps']) for entry in utils.get_catalogue()['variables'].values()])
+        if not steps & set(utils.plot_steps):
+            utils.print_message('frames: PLOT_STEPS (%s) selects none of the steps of the run' %
+                                ','.join(map(str, utils.plot_steps)))
+            sys.exit(1)
+    failed = []
+    for projection in projections:
+        for product in products:
+            prepared = render.prepare(product, projection)
+            if prepared is None:
+                continue
+            dset, args = prepared
+            if not len(dset.step):
+                utils.print_message('frames: no step of %s to draw with PLOT_STEPS, skipping' % product)
+                continue
+            profiling.latest.clear()
+            render.plot_files(dset, product, projection, **args)
+            result = profiling.latest
+            if not result:
+                utils.print_message('frames: no frame of %s %s was profiled' % (product, projection))
+                sys.exit(1)
+            if result['time'] > profiling.max_growth or result['rss'] > profiling.max_growth \
+                    or result['artists']:
+                failed.append('%s %s' % (product, projection))
+        plt.close('all')
+
+    if failed:
+        utils.print_message('frames: growing along the loop in %s' % ', '.join(failed))
+        sys.exit(1)
+    utils.print_message('frames: no growth along the loops')
+
+
+benchmarks = {
+    'contours': bench_contours,
+    'raster': bench_raster,
+    'labels': bench_labels,
+    'frames': bench_frames,
+}
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] not in benchmarks:
+        utils.print_message('Usage: benchmark.py [%s] [projections...]' %
+                            '|'.join(benchmarks.keys()))
+        sys.exit(1)
+    projections = sys.argv[2:] or ['euratl', 'nh', 'nh_polar', 'us', 'world']
+    benchmarks[sys.argv[1]](projections)
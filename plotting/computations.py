@@ -1,5 +1,6 @@
 import metpy.calc as mpcalc
 import xarray as xr
+import pandas as pd
 from metpy.units import units
 from utils import *
 
@@ -157,3 +158,39 @@ def compute_rate(dset):
     out.attrs = dset.attrs
 
     return out
+
+
+def interval_steps(steps, interval=None):
+    """Intervals (start, end) in hours over which an accumulated variable
+    (e.g. tp) is differenced, ending at the forecast steps. With interval=None
+    every interval goes from one step to the next, otherwise the intervals are
+    interval hours long. When the steps are spaced more than interval (e.g. 3h
+    intervals after +144h, where the steps are every 6 hours) the interval
+    is as long as the spacing of the steps."""
+    intervals, start = [], 0
+    for step in sorted(steps):
+        if step - start >= (interval or 0):
+            intervals.append((start, step))
+            start = step
+
+    return intervals
+
+
+def interval_accumulations(read_field, intervals):
+    """Accumulation over every interval of interval_steps and its mean rate per
+    hour, one interval at a time: read_field(step) returns the accumulated field
+    at step and only the field at the end of the last interval is kept, since it
+    is usually the start of the next one. The accumulation at step 0 is zero.
+    The accumulation keeps the name of the field, the rate is <name>_rate."""
+    previous_step, previous = 0, 0.
+    for start, end in intervals:
+        if start != previous_step:
+            previous = read_field(start)
+        field = read_field(end)
+        # The difference can be slightly negative because of the GRIB packing
+        accumulation = (field - previous).clip(min=0)
+        accumulation.attrs = dict(field.attrs, interval='%dh' % (end - start))
+        rate = accumulation / (end - start)
+        rate.attrs = dict(field.attrs, units='%s/h' % field.attrs.get('units', ''))
+        previous_step, previous = end, field
+        yield start, end, accumulation.rename(field.name), rate.rename(field.name + '_rate')
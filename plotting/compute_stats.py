@@ -0,0 +1,148 @@
+"""Run-level statistics pass, executed once after the data has been downloaded.
+For every variable and every domain it computes min, max and some percentiles
+reading one step at a time (a single GRIB message when the files have an
+index, see grib_index.py), and writes them to run_stats.json in the data folder.
+The plotting scripts read the contour levels from there (see utils.get_levels_from_stats)
+so that all the domains of a run use the same levels and no script has to reduce
+the whole array by itself.
+
+It also estimates the memory needed to render every product on every domain,
+which the orchestrator uses to decide which render tasks can run together
+(see memory_budget in orchestrator.py)."""
+import json
+import os
+import numpy as np
+import pandas as pd
+import utils
+# Variables (names from the catalogue) for which the statistics
+# are computed, with the units to convert to
+from inputs import stats_variables
+
+projections = ['euratl', 'nh', 'nh_polar', 'us', 'world', 'it', 'de']
+percentiles = [1, 5, 50, 95, 99]
+# Percentiles are computed on a strided sample of every step
+# to keep the memory bounded
+sample_stride = 7
+
+
+def compute_variable_stats(fields, masks, units=None):
+    """Reduce the fields (one DataArray per step) one at a time,
+    returning a dictionary with the statistics for every domain in masks"""
+    vmin = {domain: np.inf for domain in masks}
+    vmax = {domain: -np.inf for domain in masks}
+    samples = {domain: [] for domain in masks}
+    for values in fields:
+        if units:
+            values = values.metpy.convert_units(units).metpy.dequantify()
+        values = values.values
+        for domain, mask in masks.items():
+            domain_values = values[mask]
+            domain_values = domain_values[np.isfinite(domain_values)]
+            if domain_values.size == 0:
+                continue
+            vmin[domain] = min(vmin[domain], float(domain_values.min()))
+            vmax[domain] = max(vmax[domain], float(domain_values.max()))
+            samples[domain].append(domain_values[::sample_stride])
+
+    stats = {}
+    for domain in masks:
+        if not samples[domain]:
+            continue
+        sample = np.concatenate(samples[domain])
+        stats[domain] = {
+            'min': vmin[domain],
+            'max': vmax[domain],
+            'percentiles': {str(p): float(v) for p, v in
+                            zip(percentiles, np.percentile(sample, percentiles))}
+        }
+
+    return stats
+
+
+# Memory in MB of every process of a render task besides the data, i.e. the
+# figure and the buffers of a frame: the growth of the peak RSS of the workers
+# (see utils.print_peak_rss) over what they share with the main process is
+# 35-70 MB on the maps of products.py. The interpreter and the libraries are
+# the same for every task and are not counted, so the budget is for the data.
+worker_memory = 50.
+
+
+def estimate_memory(fields, grid_points, domain_points, steps):
+    """Peak memory in MB of rendering fields (float32) on a domain: the main
+    process reads the steps on the whole grid before cutting them to the
+    domain, and every worker of the Pool receives a chunk of steps on the
+    domain. When streaming both only read a window of steps at a time."""
+    if utils.streaming:
+        steps_read = utils.processes * utils.streaming_window
+        steps_workers = utils.processes * utils.streaming_window
+    else:
+        steps_read = steps
+        steps_workers = utils.processes * min(utils.chunks_size, steps)
+    data = fields * 4 * (grid_points * steps_read + domain_points * steps_workers)
+
+    return worker_memory * (utils.processes + 1) + data / 1024. ** 2
+
+
+def memory_estimates(catalogue, masks):
+    """Estimated memory of every product of products.py on every domain. The
+    products with inputs missing from the catalogue (e.g. a file that failed to
+    download) are left out, so that the orchestrator uses the default for them."""
+    from products import products
+    estimates = {'default': worker_memory * (utils.processes + 1)}
+    grid_points = masks['global'].size
+    for product, spec in products.items():
+        missing = [variable for variable in spec['inputs'] if variable not in catalogue['variables']]
+        if missing:
+            utils.print_message('%s not found in the catalogue, no memory estimate for %s' %
+                                (', '.join(missing), product))
+            continue
+        steps = len(catalogue['variables'][spec['inputs'][0]]['steps'])
+        fields = len(spec['inputs']) + len(spec.get('derived', [])) + len(spec.get('difference', []))
+        estimates[product] = {projection: round(estimate_memory(fields, grid_points,
+                                                                int(masks[projection].sum()), steps))
+                              for projection in projections}
+
+    return estimates
+
+
+def main():
+    # The catalogue is built once here, right after the download,
+    # and then used by all the plotting scripts
+    catalogue = utils.build_catalogue()
+    stats = {'variables': {}}
+    masks = None
+    for name, units in stats_variables.items():
+        if name not in catalogue['variables']:
+            utils.print_message('%s not found in the catalogue, skipping' % name)
+            continue
+        steps = catalogue['variables'][name]['steps']
+        field = utils.read_field(name, steps[0])
+        if masks is None:
+            # All the files are on the same grid, so compute the masks only once
+            lon, lat = utils.get_coordinates(field)
+            masks = {'global': np.ones(lon.shape, dtype=bool)}
+            for projection in projections:
+                masks[projection] = utils.get_domain_mask(lon, lat, projection)
+            stats['run'] = pd.to_datetime(field['time'].values).strftime('%Y%m%d%H')
+
+        fields = (utils.read_field(name, step) for step in steps)
+        stats['variables'][name] = compute_variable_stats(fields, masks, units)
+        stats['variables'][name]['units'] = units or field.attrs.get('units', '')
+    if masks is not None:
+        stats['memory'] = memory_estimates(catalogue, masks)
+
+    # Write to a temporary file first so that the scripts never read
+    # a partially written file
+    with open(utils.run_stats_file + '.tmp', 'w') as f:
+        json.dump(stats, f, indent=1)
+    os.replace(utils.run_stats_file + '.tmp', utils.run_stats_file)
+
+
+if __name__ == "__main__":
+    import time
+    start_time = time.time()
+    main()
+    elapsed_time = time.time()-start_time
+    utils.print_peak_rss()
+    utils.print_message("script took " + time.strftime("%H:%M:%S",
+                                                       time.gmtime(elapsed_time)))
@@ -0,0 +1,102 @@
+"""Contour lines computed once in lon/lat space and shared between projections.
+
+The topology of a contour line in geographic space does not depend on the
+projection used to display it, so the marching squares step can be done once per
+(field, run, step, levels) and cached on disk. Every domain then only has to
+transform the cached paths with its own Basemap object, which is much cheaper
+than contouring the whole field again."""
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import contourpy
+from matplotlib.contour import ContourSet
+import utils
+
+
+def cache_filename(name, run, cum_hour, levels):
+    """Build the filename of the cache entry for a given field, run, step and levels"""
+    levels_hash = hashlib.md5(
+        np.asarray(levels, dtype='float64').tobytes()).hexdigest()[:10]
+    return utils.folder + 'contours/%s_%s_%s_%s.pkl' % (
+        name, pd.to_datetime(run).strftime('%Y%m%d%H'), cum_hour, levels_hash)
+
+
+def compute_lonlat_contours(lon, lat, data, levels):
+    """Run marching squares on the field in lon/lat space. Returns, for every level,
+    a list of (n, 2) arrays of lon/lat vertices (the same layout as ContourSet.allsegs)"""
+    generator = contourpy.contour_generator(lon, lat, np.ma.masked_invalid(data),
+                                            line_type=contourpy.LineType.Separate)
+    return [generator.lines(level) for level in levels]
+
+
+def precompute(var, name, levels):
+    """Fill the cache for all steps of var (a DataArray on the full lon/lat grid,
+    before any masking). Steps already in the cache, e.g. computed by the script
+    running for another projection, are skipped."""
+    os.makedirs(utils.folder + 'contours', exist_ok=True)
+    lon, lat = utils.get_coordinates(var)
+    computed = 0
+    for step in var.step:
+        data = var.sel(step=step)
+        _, run, cum_hour = utils.get_time_run_cum(data)
+        filename = cache_filename(name, run, cum_hour, levels)
+        if os.path.isfile(filename):
+            continue
+        allsegs = compute_lonlat_contours(lon, lat, data.values, levels)
+        # Write to a temporary file first so that concurrent scripts never
+        # read a partially written entry
+        tmp_filename = filename + '.%d.tmp' % os.getpid()
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(allsegs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+        computed += 1
+
+    return computed
+
+
+def load(name, run, cum_hour, levels):
+    """Read the cached lon/lat contours, returns None if they are not available"""
+    filename = cache_filename(name, run, cum_hour, levels)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def project_contours(m, allsegs):
+    """Transform the lon/lat contours with the Basemap instance m. Points that fall
+    outside of the projection (e.g. on the back of the globe for nsper) are returned
+    by Basemap as 1e30: the segments are split there so that no spurious lines
+    are drawn."""
+    projected = []
+    for segs in allsegs:
+        level_segs = []
+        for seg in segs:
+            x, y = m(seg[:, 0], seg[:, 1])
+            valid = (np.abs(x) < 1e20) & (np.abs(y) < 1e20)
+            if valid.all():
+                level_segs.append(np.column_stack([x, y]))
+                continue
+            # Split the segment into the runs of consecutive valid points
+            edges = np.flatnonzero(np.diff(np.concatenate([[0], valid.astype(int), [0]])))
+            for start, end in zip(edges[::2], edges[1::2]):
+                if end - start > 1:
+                    level_segs.append(np.column_stack([x[start:end], y[start:end]]))
+        projected.append(level_segs)
+
+    return projected
+
+
+def contour(ax, m, x, y, data, name, levels, **kwargs):
+    """Drop-in replacement for ax.contour(x, y, data, levels=levels, **kwargs).
+    If the contour cache is enabled and contains an entry for this field the
+    cached paths are transformed with m instead of contouring again."""
+    if utils.contour_cache and m is not None:
+        _, run, cum_hour = utils.get_time_run_cum(data)
+        allsegs = load(name, run, cum_hour, levels)
+        if allsegs is not None:
+            return ContourSet(ax, levels, project_contours(m, allsegs), **kwargs)
+
+    return ax.contour(x, y, data, levels=levels, **kwargs)
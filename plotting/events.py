@@ -0,0 +1,91 @@
+"""Structured event log and metrics of the processing, enabled with EVENT_LOG=true.
+
+Every message of utils.print_message (and of the orchestrator) is also written,
+with the time, the pid and the fields of the process (run, script, product,
+projection...) plus the ones of the message (step, stage, duration...), as a
+line of JSON to events.jsonl in the folder of the run. The lines are appended
+by all the processes to the same file, so the timeline of a run can be
+rebuilt sorting them by time, e.g.
+
+    jq -c 'select(.message == "frame")' runs/2026101900/events.jsonl
+
+At the end of a run the orchestrator summarises the log and its report into
+metrics in the Prometheus text format (see write_metrics), written to
+METRICS_TEXTFILE for the textfile collector of node_exporter.
+
+This module doesn't import anything of the plotting, so that the orchestrator
+can use it as well."""
+import json
+import os
+import time
+
+# File of the event log, None when disabled (see configure)
+event_file = None
+# Fields added to every event of this process
+context = {}
+# Prefix of the names of the metrics
+prefix = 'ecmwf_hres_'
+
+
+def configure(path, **fields):
+    """Write the events of this process (and of the ones forked from it) to path"""
+    global event_file
+    event_file = path
+    context.update(fields)
+
+
+def log(message, **fields):
+    """Append an event to the log, if enabled"""
+    if event_file is None:
+        return
+    record = dict(time=round(time.time(), 3), pid=os.getpid(), **context)
+    record.update(fields, message=message)
+    # A single write of a whole line, so that the lines of the
+    # processes appending at the same time are not mixed
+    with open(event_file, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+def read_events(path):
+    """Events of a log, skipping the lines that can't be parsed"""
+    events = []
+    if not os.path.isfile(path):
+        return events
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return events
+
+
+def escape_label(value):
+    """Label value in the text format: backslash first, then quotes and newlines"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_metric(name, kind, description, samples):
+    """Lines of a metric: samples are (labels, value)"""
+    lines = ['# HELP %s%s %s' % (prefix, name, description),
+             '# TYPE %s%s %s' % (prefix, name, kind)]
+    for labels, value in samples:
+        label_text = ','.join('%s="%s"' % (key, escape_label(labels[key])) for key in sorted(labels))
+        lines.append('%s%s%s %s' % (prefix, name, '{%s}' % label_text if label_text else '',
+                                    repr(float(value))))
+
+    return lines
+
+
+def write_metrics(path, metrics):
+    """Write metrics, name -> (kind, description, samples), in the Prometheus
+    text format. The file is replaced as a whole, so the collector never reads
+    half of it."""
+    lines = []
+    for name, (kind, description, samples) in metrics.items():
+        lines += format_metric(name, kind, description, samples)
+    lines.append('# EOF')
+    with open(path + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,150 @@
+"""Compact index of the messages in a GRIB file, written next to it while
+downloading: (param, level, step) -> byte offset and length of the message.
+When the steps are downloaded as they are published the index is extended
+together with the file (see append).
+With the index a single field can be decoded reading only its own bytes
+(through mmap) instead of scanning the whole file."""
+import json
+import mmap
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import xarray as xr
+import eccodes
+
+index_suffix = '.gribidx'
+
+
+def message_key(short_name, type_of_level, level, step):
+    return '%s/%s/%d/%d' % (short_name, type_of_level, level, step)
+
+
+def scan_messages(filename, offset=0):
+    """Offsets and lengths of all the messages of filename (shifted by offset)
+    and the description of every variable. Besides the GRIB keys it stores the
+    name cfgrib would give to the variable (cfVarName), so that the catalogue
+    can be built from the index."""
+    messages, variables = {}, {}
+    with open(filename, 'rb') as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                short_name = eccodes.codes_get(gid, 'shortName')
+                type_of_level = eccodes.codes_get(gid, 'typeOfLevel')
+                level = eccodes.codes_get(gid, 'level')
+                step = eccodes.codes_get(gid, 'endStep')
+                key = message_key(short_name, type_of_level, level, step)
+                messages[key] = [offset + int(eccodes.codes_get(gid, 'offset')),
+                                 int(eccodes.codes_get(gid, 'totalLength'))]
+                variables.setdefault('%s/%s/%d' % (short_name, type_of_level, level), {
+                    'name': eccodes.codes_get(gid, 'cfVarName'),
+                    'shortName': short_name,
+                    'typeOfLevel': type_of_level,
+                    'level': level,
+                    'run': '%08d%02d' % (eccodes.codes_get(gid, 'dataDate'),
+                                         eccodes.codes_get(gid, 'dataTime') // 100),
+                })
+            finally:
+                eccodes.codes_release(gid)
+
+    return messages, variables
+
+
+def write_index(filename, index):
+    tmp_filename = filename + index_suffix + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_filename, filename + index_suffix)
+
+
+def build_index(filename):
+    """Scan the messages of filename once and write the index next to it"""
+    messages, variables = scan_messages(filename)
+    index = {'file_size': os.path.getsize(filename),
+             'variables': variables,
+             'messages': messages}
+    write_index(filename, index)
+
+    return index
+
+
+def append(filename, part_filename):
+    """Append the messages of part_filename (e.g. the steps that were just
+    published) to filename, indexing only the new messages"""
+    if os.path.isfile(filename):
+        index = load_index(filename) or build_index(filename)
+    else:
+        index = {'file_size': 0, 'variables': {}, 'messages': {}}
+    messages, variables = scan_messages(part_filename, offset=index['file_size'])
+    with open(filename, 'ab') as f, open(part_filename, 'rb') as part:
+        shutil.copyfileobj(part, f)
+    index['messages'].update(messages)
+    for key, variable in variables.items():
+        index['variables'].setdefault(key, variable)
+    index['file_size'] = os.path.getsize(filename)
+    write_index(filename, index)
+
+    return index
+
+
+def load_index(filename):
+    """Read the index of filename, None if it's missing or
+    if it does not match the file anymore"""
+    if not os.path.isfile(filename + index_suffix):
+        return None
+    with open(filename + index_suffix, 'r') as f:
+        index = json.load(f)
+    if index['file_size'] != os.path.getsize(filename):
+        return None
+
+    return index
+
+
+def decode_message(filename, offset, length):
+    """Decode the message at offset in filename as a DataArray with the same
+    coordinates and names that cfgrib would use. Only the bytes of the message
+    are read from the file."""
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            gid = eccodes.codes_new_from_message(mm[offset:offset + length])
+    try:
+        ni, nj = eccodes.codes_get(gid, 'Ni'), eccodes.codes_get(gid, 'Nj')
+        values = eccodes.codes_get_values(gid).reshape(nj, ni).astype('float32')
+        lat_first = eccodes.codes_get(gid, 'latitudeOfFirstGridPointInDegrees')
+        lon_first = eccodes.codes_get(gid, 'longitudeOfFirstGridPointInDegrees')
+        dlat = eccodes.codes_get(gid, 'jDirectionIncrementInDegrees')
+        dlon = eccodes.codes_get(gid, 'iDirectionIncrementInDegrees')
+        if not eccodes.codes_get(gid, 'jScansPositively'):
+            dlat = -dlat
+        run = pd.to_datetime('%08d%04d' % (eccodes.codes_get(gid, 'dataDate'),
+                                           eccodes.codes_get(gid, 'dataTime')),
+                             format='%Y%m%d%H%M')
+        step = pd.Timedelta(hours=eccodes.codes_get(gid, 'endStep'))
+        name = eccodes.codes_get(gid, 'cfVarName')
+        attrs = {'units': eccodes.codes_get(gid, 'units'),
+                 'long_name': eccodes.codes_get(gid, 'name'),
+                 'GRIB_shortName': eccodes.codes_get(gid, 'shortName')}
+    finally:
+        eccodes.codes_release(gid)
+
+    longitude = lon_first + dlon * np.arange(ni)
+    longitude = ((longitude + 180.) % 360.) - 180.
+
+    return xr.DataArray(values, name=name, attrs=attrs,
+                        dims=['latitude', 'longitude'],
+                        coords={'latitude': lat_first + dlat * np.arange(nj),
+                                'longitude': longitude,
+                                'time': run, 'step': step,
+                                'valid_time': run + step})
+
+
+def read_field(filename, short_name, type_of_level, level, step, index=None):
+    """Decode a single field of filename using its index"""
+    if index is None:
+        index = load_index(filename)
+    offset, length = index['messages'][message_key(short_name, type_of_level, level, step)]
+
+    return decode_message(filename, offset, length)
@@ -0,0 +1,216 @@
+"""Decoded store of the run, built once after the data has been downloaded.
+Every field of the catalogue is decoded from the GRIB files (one message at a
+time, see grib_index.py) and written to a zarr store, decoded.zarr in the data
+folder, at several resolutions: level 0 is the original grid and every other
+level averages blocks of 2x2, 4x4... points (see pyramid_factors).
+utils.read_dataset reads from the store when DECODED_STORE=true, picking for
+every projection the coarsest level that is still fine enough for the size
+of the map (see utils.get_pyramid_level), so that e.g. the world map doesn't
+read and contour the whole 0.25 degrees grid.
+
+Steps already in the store are skipped, so this can be run again when new
+steps are appended to the files of the run (see watcher.py). Once the run is
+complete the orchestrator copies the store to the archive of the last runs
+(see archive.py).
+
+The fields are only ever shown at the precision of the contour levels, so they
+are stored with a loss declared for every variable in `quantisation`:
+
+    tolerance    maximum absolute error (units of the GRIB field): stored as
+                 int16 with a scale of 2 * tolerance around offset
+    keepbits     bits of the mantissa kept (bit-rounding), for the fields that
+                 span several orders of magnitude: relative error 2**-(keepbits+1)
+
+and compressed with blosc/zstd. The variables that are not declared are stored
+as they are. `python ingest.py check` compares the store with the GRIB files
+and fails if any variable is off by more than its tolerance."""
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+import xarray as xr
+from zarr.codecs import BloscCodec
+import utils
+
+# Averaging factor of every level of the pyramid
+pyramid_factors = [1, 2, 4]
+
+# Loss allowed for every variable of the catalogue, see above
+quantisation = {
+    't2m': dict(tolerance=0.01, offset=273.15),
+    't_500': dict(tolerance=0.01, offset=273.15),
+    't_850': dict(tolerance=0.01, offset=273.15),
+    'msl': dict(tolerance=1., offset=100000.),
+    'gh_250': dict(tolerance=0.5, offset=10000.),
+    'gh_500': dict(tolerance=0.5, offset=5500.),
+    'u10': dict(tolerance=0.01, offset=0.),
+    'v10': dict(tolerance=0.01, offset=0.),
+    'u_250': dict(tolerance=0.01, offset=0.),
+    'v_250': dict(tolerance=0.01, offset=0.),
+    'tcwv': dict(tolerance=0.01, offset=300.),
+    'r_850': dict(tolerance=0.01, offset=0.),
+    # Accumulated from the start of the run, from 0 to more than 1 m
+    'tp': dict(keepbits=12),
+    'd_850': dict(keepbits=10),
+    'vo_850': dict(keepbits=10),
+}
+compressor = BloscCodec(cname='zstd', clevel=5, shuffle='shuffle')
+
+
+def bitround(values, keepbits):
+    """Round the mantissa of the float32 values to keepbits bits"""
+    bits = values.astype(np.float32).view(np.uint32)
+    drop = 23 - keepbits
+    half = np.uint32((1 << (drop - 1)) - 1)
+    mask = np.uint32(~((1 << drop) - 1) & 0xffffffff)
+    # Round half to even
+    bits = (bits + half + ((bits >> drop) & 1)) & mask
+
+    return bits.view(np.float32)
+
+
+def quantise(dset):
+    """Apply the bit-rounding and clip the int16 variables to their range,
+    returning the encoding of every variable"""
+    encoding = {}
+    for variable in dset.data_vars:
+        encoding[variable] = {'compressors': (compressor,)}
+        spec = quantisation.get(variable, {})
+        if 'keepbits' in spec:
+            dset[variable].values = bitround(dset[variable].values, spec['keepbits'])
+        elif 'tolerance' in spec:
+            scale = 2 * spec['tolerance']
+            low, high = spec['offset'] - 32767 * scale, spec['offset'] + 32767 * scale
+            values = dset[variable].values
+            if np.nanmin(values) < low or np.nanmax(values) > high:
+                utils.print_message('%s out of the range of the store, clipped to %g-%g' % (variable, low, high))
+                dset[variable].values = np.clip(values, low, high)
+            encoding[variable].update(dtype='int16', scale_factor=scale,
+                                      add_offset=spec['offset'], _FillValue=-32768)
+
+    return encoding
+
+
+def read_step(catalogue, step):
+    """All the variables of the catalogue at step as a dataset with a step
+    dimension, named with the catalogue names (e.g. t2m, gh_500)"""
+    fields = {variable: utils.read_field(variable, step) for variable in catalogue['variables']}
+    first = next(iter(fields.values()))
+    dset = xr.Dataset({variable: field.drop_vars([c for c in field.coords
+                                                  if c not in ['latitude', 'longitude']])
+                       for variable, field in fields.items()})
+    dset = dset.expand_dims(step=[first['step'].values])
+    dset = dset.assign_coords(valid_time=('step', [first['valid_time'].values]),
+                              time=first['time'].values)
+    dset.attrs['run'] = pd.to_datetime(first['time'].values).strftime('%Y%m%d%H')
+
+    return dset
+
+
+def coarsen(dset, factor):
+    """Average blocks of factor x factor points (the coordinates as well)"""
+    if factor == 1:
+        return dset
+    coarse = dset.coarsen(latitude=factor, longitude=factor, boundary='trim').mean()
+    for variable in dset.data_vars:
+        coarse[variable].attrs = dset[variable].attrs
+
+    return coarse
+
+
+def stored_steps(run):
+    """Steps (hours) already in the store, if it belongs to run"""
+    if not os.path.isdir(utils.decoded_store_file):
+        return []
+    try:
+        dset = xr.open_zarr(utils.decoded_store_file, group='level_0')
+    except (OSError, KeyError, ValueError):
+        return []
+    if dset.attrs.get('run') != run:
+        return []
+
+    return (dset['step'].values / pd.Timedelta('1 hour')).astype(int).tolist()
+
+
+def ingest():
+    catalogue = utils.get_catalogue()
+    run = next(iter(catalogue['variables'].values()))['run']
+    # Only the steps available for all the variables
+    steps = sorted(set.intersection(*[set(entry['steps']) for entry in catalogue['variables'].values()]))
+    done = stored_steps(run)
+    if not done and os.path.isdir(utils.decoded_store_file):
+        # The store of another run
+        shutil.rmtree(utils.decoded_store_file)
+    new_steps = [step for step in steps if step not in done]
+    if done and new_steps and new_steps[0] < done[-1]:
+        utils.print_message('Steps %s are older than the ones in the store, rebuilding it' % new_steps)
+        shutil.rmtree(utils.decoded_store_file)
+        done, new_steps = [], steps
+
+    for step in new_steps:
+        dset = read_step(catalogue, step)
+        for level, factor in enumerate(pyramid_factors):
+            level_dset = coarsen(dset, factor)
+            encoding = quantise(level_dset)
+            if not done and step == new_steps[0]:
+                # One chunk per step and field, so that a step is read on its own
+                for variable in level_dset.data_vars:
+                    encoding[variable]['chunks'] = (1,) + level_dset[variable].shape[1:]
+                # Fixed units, otherwise they're chosen from the first step only
+                encoding['step'] = {'units': 'hours', 'dtype': 'int64'}
+                encoding['valid_time'] = {'units': 'hours since 1970-01-01', 'dtype': 'int64'}
+                level_dset.to_zarr(utils.decoded_store_file, group='level_%d' % level,
+                                   mode='w', encoding=encoding, consolidated=True)
+            else:
+                level_dset.drop_vars('time').to_zarr(utils.decoded_store_file, group='level_%d' % level,
+                                                     mode='a', append_dim='step', consolidated=True)
+
+    return len(new_steps)
+
+
+def check():
+    """Largest error of every variable of the store (level 0) against the GRIB
+    files, returning the variables off by more than their tolerance"""
+    catalogue = utils.get_catalogue()
+    store = xr.open_zarr(utils.decoded_store_file, group='level_0')
+    failed = []
+    for variable in store.data_vars:
+        spec = quantisation.get(variable, {})
+        errors = []
+        for step in store['step'].values:
+            hours = int(step / pd.Timedelta('1 hour'))
+            original = utils.read_field(variable, hours).values
+            error = np.abs(store[variable].sel(step=step).values - original)
+            if 'keepbits' in spec:
+                error = error / np.maximum(np.abs(original), np.finfo(np.float32).tiny)
+            errors.append(np.nanmax(error))
+        if 'keepbits' in spec:
+            tolerance = 2. ** -(spec['keepbits'] + 1)
+        else:
+            # A little margin for the float32 arithmetic of scale and offset,
+            # the variables that are not declared must be exact
+            tolerance = spec.get('tolerance', 0.) * (1 + 1e-3)
+        status = 'ok' if max(errors) <= tolerance else 'FAILED'
+        utils.print_message('%-8s max error %.3g (tolerance %.3g) %s' % (variable, max(errors), tolerance, status))
+        if status != 'ok':
+            failed.append(variable)
+    missing = [variable for variable in catalogue['variables'] if variable not in store.data_vars]
+    if missing:
+        utils.print_message('Not in the store: %s' % ', '.join(missing))
+
+    return failed
+
+
+if __name__ == "__main__":
+    import time
+    if sys.argv[1:] == ['check']:
+        sys.exit(1 if check() else 0)
+    start_time = time.time()
+    ingested = ingest()
+    size = sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(utils.decoded_store_file) for f in files)
+    utils.print_message('%d steps ingested, store is %.1f MB' % (ingested, size / 1e6))
+    elapsed_time = time.time()-start_time
+    utils.print_message(
+        "script took " + time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
@@ -0,0 +1,55 @@
+"""Variables (names from the catalogue, e.g. t2m, gh_500) read from the run by
+the products and the other processing steps. They are plain data, without any
+import, so that download_data.py knows what to download without loading the
+plotting modules.
+
+    product_inputs     inputs of every product of products.py
+    tile_inputs        inputs of every product of plot_tiles.py
+    stats_variables    run statistics (compute_stats.py), with the units to convert to
+    points_variables   time series at points (meteograms.py), with their units in the table"""
+
+product_inputs = {
+    'winds_jet': ['u_250', 'v_250', 'gh_250'],
+    'precip_acc': ['tp', 'msl'],
+    'precip_3h': ['tp', 'msl'],
+    'precip_6h': ['tp', 'msl'],
+    'precip_24h': ['tp', 'msl'],
+    'gph_500': ['t_850', 'gh_500'],
+    'winds10m': ['u10', 'v10', 'msl'],
+    't_v_pres': ['t2m', 'u10', 'v10', 'msl'],
+    'msl_diff': ['msl'],
+    't2m_diff': ['t2m', 'msl'],
+}
+
+tile_inputs = {
+    'precip_acc': ['tp'],
+    't2m': ['t2m'],
+    'winds10m': ['u10', 'v10'],
+}
+
+stats_variables = {
+    'msl': 'hPa',
+    't2m': 'degC',
+    'tp': 'mm',
+    't_850': 'degC',
+    'gh_500': None,
+    'gh_250': None,
+}
+
+points_variables = {
+    't2m': 'degC',
+    'tp': 'mm',
+    'msl': 'hPa',
+    'u10': 'kph',
+    'v10': 'kph',
+    'tcwv': 'kg m**-2',
+}
+
+
+def required_variables():
+    """All the variables read by the products and the other steps"""
+    variables = set(stats_variables) | set(points_variables)
+    for names in list(product_inputs.values()) + list(tile_inputs.values()):
+        variables |= set(names)
+
+    return sorted(variables)
@@ -0,0 +1,135 @@
+"""Fast placement of contour labels, in place of ax.clabel(..., inline=True).
+clabel measures the extent of every candidate label and cuts the contour
+paths around it, which is one of the slowest parts of a frame. Here:
+
+- the labels are placed along the contour paths (in pixels) every `spacing`
+  pixels, skipping the paths too short to hold one, all with array operations;
+- if the contours of a level only moved slightly since the previous step
+  (every previous label is within `tolerance` pixels of the new lines) the
+  labels stay where they were, snapped to the new lines, so they don't jump
+  around from one frame to the next in the animations;
+- all the labels are drawn as a single PathCollection of text outlines
+  instead of one Text artist each.
+
+The lines are not cut under the labels. Enabled with FAST_LABELS=true,
+see render.py."""
+import numpy as np
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+from scipy.spatial import cKDTree
+
+# Outlines of the label texts, centered in (0, 0), in points
+text_paths = {}
+# Labels drawn in the previous step: (axes, name) -> level -> positions in pixels
+previous_positions = {}
+
+
+def get_text_path(text, fontsize):
+    """Outline of text centered in (0, 0) and its width, in points"""
+    if (text, fontsize) not in text_paths:
+        path = TextPath((0, 0), text, size=fontsize)
+        # The control points are enough for the extent, Path.get_extents is slow
+        vmin, vmax = path.vertices.min(axis=0), path.vertices.max(axis=0)
+        text_paths[(text, fontsize)] = (Path(path.vertices - (vmin + vmax) / 2, path.codes),
+                                        vmax[0] - vmin[0])
+    return text_paths[(text, fontsize)]
+
+
+def segments_in_pixels(ax, segments):
+    """Segments of a level (data coordinates) transformed to pixels all together,
+    returned as the vertices and the index of the segment of every vertex"""
+    segments = [s for s in segments if len(s) > 1]
+    if not segments:
+        return np.empty((0, 2)), np.empty(0, dtype=int)
+    vertices = ax.transData.transform(np.concatenate(segments))
+
+    return vertices, np.repeat(np.arange(len(segments)), [len(s) for s in segments])
+
+
+def rotation_at(vertices, ids, k):
+    """Angle (degrees, always readable) of the lines at the vertices k"""
+    k = np.clip(k, 1, len(vertices) - 2)
+    same = (ids[k - 1] == ids[k]) & (ids[k + 1] == ids[k])
+    before = np.where(same[:, None], vertices[k - 1], vertices[k])
+    after = np.where(same[:, None], vertices[k + 1], vertices[k])
+    delta = after - before
+    angle = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+
+    return (angle + 90) % 180 - 90
+
+
+def new_positions(vertices, ids, bbox, min_length, spacing):
+    """Indices of the vertices where the labels of a level go: along every
+    segment longer than min_length, one every spacing pixels"""
+    step = np.hypot(*np.diff(vertices, axis=0).T)
+    step[ids[1:] != ids[:-1]] = 0
+    distance = np.concatenate([[0], np.cumsum(step)])
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    ends = np.concatenate([starts[1:], [len(ids)]]) - 1
+    lengths = distance[ends] - distance[starts]
+    targets = []
+    for start, length in zip(distance[starts][lengths >= min_length], lengths[lengths >= min_length]):
+        count = max(1, int(length // spacing))
+        targets.append(start + (np.arange(count) + 0.5) * length / count)
+    if not targets:
+        return np.empty(0, dtype=int)
+    k = np.clip(np.searchsorted(distance, np.concatenate(targets)), 0, len(vertices) - 1)
+    inside = (vertices[k, 0] > bbox.x0) & (vertices[k, 0] < bbox.x1) & \
+        (vertices[k, 1] > bbox.y0) & (vertices[k, 1] < bbox.y1)
+
+    return k[inside]
+
+
+def level_colors(c):
+    """Color of the lines of every level"""
+    try:
+        colors = c.get_edgecolor()
+    except AttributeError:
+        # Before matplotlib 3.8 every level is a separate collection
+        return [coll.get_edgecolor()[0] for coll in c.collections]
+    return [colors[i % len(colors)] for i in range(len(c.levels))]
+
+
+def clabel(ax, c, name, fmt='%4.0f', fontsize=8, spacing=300, tolerance=20, path_effects=None):
+    """Label the lines of the contour set c, returning the artist to remove
+    afterwards. name identifies the field, to find the labels of the previous step."""
+    bbox = ax.get_window_extent()
+    scale = ax.figure.dpi / 72.
+    previous = previous_positions.get((id(ax), name), {})
+    current = {}
+    paths, offsets, facecolors = [], [], []
+    for level, segments, color in zip(c.levels, c.allsegs, level_colors(c)):
+        vertices, ids = segments_in_pixels(ax, segments)
+        if len(vertices) < 3:
+            continue
+        text = fmt % level
+        text_path, width = get_text_path(text, fontsize)
+        width = width * scale
+        k = None
+        if level in previous and len(previous[level]):
+            distance, nearest = cKDTree(vertices).query(previous[level])
+            if (distance < tolerance).all():
+                k = nearest
+        if k is None:
+            k = new_positions(vertices, ids, bbox, min_length=3 * width, spacing=spacing)
+        if not len(k):
+            continue
+        current[level] = vertices[k]
+        for position, angle in zip(vertices[k], rotation_at(vertices, ids, k)):
+            paths.append(text_path.transformed(Affine2D().scale(scale).rotate_deg(angle)))
+            offsets.append(position)
+            facecolors.append(color)
+    previous_positions[(id(ax), name)] = current
+
+    # The outlines are in pixels, placed at the positions in data coordinates
+    positions = ax.transData.inverted().transform(np.array(offsets).reshape(-1, 2))
+    labels = PathCollection(paths, offsets=positions, offset_transform=ax.transData,
+                            transform=Affine2D(), facecolors=facecolors,
+                            edgecolors='none', zorder=3)
+    if path_effects:
+        labels.set_path_effects(path_effects)
+    ax.add_collection(labels, autolim=False)
+
+    return labels
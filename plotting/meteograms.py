@@ -0,0 +1,161 @@
+"""Time series of the forecast at points, e.g. cities, extracted from the whole run.
+The interpolation weights of all the points are computed once (nearest grid
+point from a KD-tree, then the grid cell around it for the bilinear weights)
+and every step of every variable is then a single gather of the points.
+
+    python meteograms.py points.csv            one point per row, columns name,lon,lat
+    python meteograms.py Milano Hamburg 7.6,45.1 ...   cities or lon,lat pairs
+
+The series are written in a single table, points.csv (POINTS_OUTPUT=parquet for
+points.parquet), in the folder of the run. With METEOGRAMS=true a meteogram
+of every point is also plotted in the meteograms/ folder of the images."""
+import os
+import sys
+import numpy as np
+import pandas as pd
+import xarray as xr
+from multiprocessing import Pool
+from scipy.spatial import cKDTree
+import utils
+# Variables extracted (names from the catalogue) and their units in the table
+from inputs import points_variables as variables
+
+output_format = os.environ.get('POINTS_OUTPUT', 'csv')
+plot_meteograms = os.environ.get('METEOGRAMS', 'false').lower() in ['1', 'true', 'yes']
+
+
+def read_points(arguments):
+    """Points as a DataFrame with columns name, lon, lat from a CSV file
+    or from a list of city names and lon,lat pairs. The names identify the
+    rows of the table and the meteograms, so they must be unique."""
+    if len(arguments) == 1 and arguments[0].endswith('.csv'):
+        points = pd.read_csv(arguments[0])[['name', 'lon', 'lat']]
+    else:
+        points = []
+        for argument in arguments:
+            try:
+                lon, lat = [float(c) for c in argument.split(',')]
+            except ValueError:
+                lon, lat = utils.get_city_coordinates(argument)
+            points.append({'name': argument, 'lon': lon, 'lat': lat})
+        points = pd.DataFrame(points)
+    duplicated = points['name'][points['name'].duplicated()].unique()
+    if len(duplicated):
+        raise ValueError('Points given more than once: %s' % ', '.join(map(str, duplicated)))
+
+    return points
+
+
+def to_xyz(lon, lat):
+    """Cartesian coordinates on the unit sphere, so that the distances in the
+    KD-tree don't depend on the latitude and there is no seam at the dateline"""
+    lon, lat = np.deg2rad(lon), np.deg2rad(lat)
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def get_weights(lon, lat, points, method='bilinear'):
+    """Flat indices in the (lat, lon) grid and weights to interpolate at the
+    points, both (number of points, 1) for nearest and (number of points, 4)
+    for bilinear. lon and lat are the 1D coordinates of a regular grid."""
+    lon2d, lat2d = np.meshgrid(lon, lat)
+    tree = cKDTree(to_xyz(lon2d.ravel(), lat2d.ravel()))
+    _, nearest = tree.query(to_xyz(points['lon'].values, points['lat'].values))
+    if method == 'nearest':
+        return nearest[:, None], np.ones((len(nearest), 1))
+
+    ny, nx = lon2d.shape
+    i, j = np.unravel_index(nearest, lon2d.shape)
+    dx, dy = lon[1] - lon[0], lat[1] - lat[0]
+    # Fractional position of the points in the grid, starting from the nearest point
+    fj = j + ((points['lon'].values - lon[j] + 180) % 360 - 180) / dx
+    fi = i + (points['lat'].values - lat[i]) / dy
+    periodic = np.isclose(nx * abs(dx), 360)
+    j0 = np.floor(fj).astype(int) if periodic else np.clip(np.floor(fj).astype(int), 0, nx - 2)
+    i0 = np.clip(np.floor(fi).astype(int), 0, ny - 2)
+    wx, wy = np.clip(fj - j0, 0, 1), np.clip(fi - i0, 0, 1)
+    j0, j1 = j0 % nx, (j0 + 1) % nx
+    index = np.stack([i0 * nx + j0, i0 * nx + j1, (i0 + 1) * nx + j0, (i0 + 1) * nx + j1], axis=1)
+    weights = np.stack([(1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy], axis=1)
+
+    return index, weights
+
+
+def extract(points, index, weights):
+    """Table with a row for every point and step and a column for every variable"""
+    catalogue = utils.get_catalogue()
+    series = []
+    for variable, units in variables.items():
+        if variable not in catalogue['variables']:
+            continue
+        steps = catalogue['variables'][variable]['steps']
+        values = np.empty((len(steps), len(points)), dtype='float32')
+        for k, step in enumerate(steps):
+            field = utils.read_field(variable, step)
+            values[k] = (field.values.ravel()[index] * weights).sum(axis=1)
+        values = xr.DataArray(values, attrs={'units': field.attrs['units']}
+                              ).metpy.convert_units(units).metpy.dequantify().values
+        series.append(pd.DataFrame({variable: values.ravel()},
+                                   index=pd.MultiIndex.from_product([steps, points['name']],
+                                                                    names=['step', 'name'])))
+    table = pd.concat(series, axis=1).reset_index()
+    run = pd.to_datetime(catalogue['variables']['msl']['run'], format='%Y%m%d%H')
+    table.insert(0, 'run', run)
+    table.insert(2, 'valid_time', run + pd.to_timedelta(table['step'], unit='h'))
+    table = table.merge(points, on='name')
+
+    return table.sort_values(['name', 'step'])
+
+
+def plot_meteogram(point):
+    """Temperature, precipitation in every step, pressure and wind of a point"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    name, table = point
+    fig, axs = plt.subplots(3, 1, figsize=(utils.figsize_x, utils.figsize_y), sharex=True)
+    axs[0].plot(table['valid_time'], table['t2m'], color='tab:red')
+    axs[0].set_ylabel('Temperature [C]')
+    # Precipitation in the hours before every step, the bars end at the step
+    axs[1].bar(table['valid_time'], np.diff(table['tp'], prepend=0).clip(min=0),
+               width=-np.diff(table['step'], prepend=0) / 24., align='edge', color='tab:blue')
+    axs[1].set_ylabel('Precipitation [mm]')
+    axs[2].plot(table['valid_time'], table['msl'], color='black')
+    axs[2].set_ylabel('MSLP [hPa]')
+    ax_wind = axs[2].twinx()
+    ax_wind.plot(table['valid_time'], np.hypot(table['u10'], table['v10']), color='tab:green')
+    ax_wind.set_ylabel('Wind [km/h]')
+    for ax in axs:
+        ax.grid(True, alpha=0.3)
+    utils.annotation_run(axs[0], table['run'].iloc[0])
+    axs[0].set_title('%s (%.2f, %.2f)' % (name, table['lon'].iloc[0], table['lat'].iloc[0]), loc='left')
+    plt.savefig(utils.folder_images + 'meteograms/%s.png' % name.replace('/', '_').replace(' ', '_'),
+                **utils.options_savefig)
+    plt.close(fig)
+
+
+def main():
+    points = read_points(sys.argv[1:])
+    field = utils.read_field('msl', utils.get_catalogue()['variables']['msl']['steps'][0])
+    index, weights = get_weights(field['longitude'].values, field['latitude'].values, points)
+    table = extract(points, index, weights)
+    filename = utils.folder + 'points.' + output_format
+    if output_format == 'parquet':
+        table.to_parquet(filename, index=False)
+    else:
+        table.to_csv(filename, index=False)
+    utils.print_message('%d points, %d rows written to %s' % (len(points), len(table), filename))
+
+    if plot_meteograms:
+        os.makedirs(utils.folder_images + 'meteograms', exist_ok=True)
+        p = Pool(utils.processes)
+        p.map(plot_meteogram, list(table.groupby('name')))
+
+
+if __name__ == "__main__":
+    import time
+    start_time = time.time()
+    main()
+    elapsed_time = time.time()-start_time
+    utils.print_message(
+        "script took " + time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
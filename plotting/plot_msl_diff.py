@@ -0,0 +1,5 @@
+"""Change of MSLP since the previous run (products.py)"""
+import render
+
+if __name__ == "__main__":
+    render.run('msl_diff')
@@ -0,0 +1,5 @@
+"""Precipitation in the last 6 hours and MSLP (products.py)"""
+import render
+
+if __name__ == "__main__":
+    render.run('precip_6h')
@@ -1,154 +1,5 @@
-import matplotlib.pyplot as plt
-import numpy as np
-from multiprocessing import Pool
-from functools import partial
-import utils
-import sys
-import metpy.calc as mpcalc
-import xarray as xr
-
-debug = False
-if not debug:
-    import matplotlib
-    matplotlib.use('Agg')
-
-
-# The one employed for the figure name when exported
-variable_name = 't_v_pres'
-
-utils.print_message('Starting script to plot '+variable_name)
-
-# Get the projection as system argument from the call so that we can
-# span multiple instances of this script outside
-if not sys.argv[1:]:
-    utils.print_message(
-        'Projection not defined, falling back to default (nh)')
-    projection = 'nh'
-else:
-    projection = sys.argv[1]
-
-
-def main():
-    """In the main function we basically read the files and prepare the variables to be plotted.
-    This is not included in utils.py as it can change from case to case."""
-    t2m = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
-                          backend_kwargs={'filter_by_keys': {'typeOfLevel': 'heightAboveGround', 'level': 2}})
-    winds = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
-                            backend_kwargs={'filter_by_keys': {'typeOfLevel': 'heightAboveGround', 'level': 10}})
-    msl = xr.open_dataset(f'{utils.folder}/vars_2D.grib2',
-                          backend_kwargs={'filter_by_keys': {'shortName': 'msl'}})
-    dset = xr.merge([t2m, winds, msl], compat='override')
-
-    dset['t2m'] = dset['t2m'].metpy.convert_units('degC').metpy.dequantify()
-    dset['msl'] = dset['msl'].metpy.convert_units('hPa').metpy.dequantify()
-
-    levels_t2m = np.arange(-40, 50, 1)
-
-    cmap = utils.get_colormap("temp")
-    _ = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
-
-    ax = plt.gca()
-    _, x, y, mask = utils.get_projection(dset, projection)
-    # Subset dataset only on the area
-    dset = dset.where(mask, drop=True)
-    # and then compute what we need
-
-    levels_mslp = np.arange(dset['msl'].min().astype("int"),
-                            dset['msl'].max().astype("int"), 4.)
-
-    # All the arguments that need to be passed to the plotting function
-    args = dict(x=x, y=y, ax=ax, cmap=cmap,
-                levels_t2m=levels_t2m, levels_mslp=levels_mslp)
-
-    utils.print_message('Pre-processing finished, launching plotting scripts')
-    if debug:
-        plot_files(dset.isel(time=slice(0, 2)), **args)
-    else:
-        # Parallelize the plotting by dividing into chunks and processes
-        dss = utils.chunks_dataset(dset, utils.chunks_size)
-        plot_files_param = partial(plot_files, **args)
-        p = Pool(utils.processes)
-        p.map(plot_files_param, dss)
-
-
-def plot_files(dss, **args):
-    first = True
-    for time_sel in dss.step:
-        data = dss.sel(step=time_sel)
-        # data['msl'].values = mpcalc.smooth_n_point(
-        #     data['msl'].values, n=9, passes=10)
-        time, run, cum_hour = utils.get_time_run_cum(data)
-        # Build the name of the output image
-        filename = utils.subfolder_images[projection] + \
-            '/' + variable_name + '_%s.png' % cum_hour
-
-        cs = args['ax'].contourf(args['x'], args['y'],
-                                 data['t2m'],
-                                 extend='both',
-                                 cmap=args['cmap'],
-                                 levels=args['levels_t2m'])
-
-        cs2 = args['ax'].contour(args['x'], args['y'],
-                                 data['t2m'],
-                                 extend='both',
-                                 levels=args['levels_t2m'][::5],
-                                 linewidths=0.3,
-                                 colors='gray', alpha=0.7)
-
-        c = args['ax'].contour(args['x'], args['y'],
-                               data['msl'],
-                               levels=args['levels_mslp'],
-                               colors='white', linewidths=1.)
-
-        labels = args['ax'].clabel(
-            c, c.levels, inline=True, fmt='%4.0f', fontsize=6)
-        labels2 = args['ax'].clabel(
-            cs2, cs2.levels, inline=True, fmt='%2.0f', fontsize=7)
-
-        maxlabels = utils.plot_maxmin_points(args['ax'], args['x'], args['y'], data['msl'],
-                                             'max', 60, symbol='H', color='royalblue', random=True)
-        minlabels = utils.plot_maxmin_points(args['ax'], args['x'], args['y'], data['msl'],
-                                             'min', 60, symbol='L', color='coral', random=True)
-
-        # We need to reduce the number of points before plotting the vectors,
-        # these values work pretty well
-        if projection != 'world':
-            density = 10
-            scale = 5e2
-        else:
-            density = 35
-            scale = 5e2
-        cv = args['ax'].quiver(args['x'][::density, ::density],
-                               args['y'][::density, ::density],
-                               data['u10'][::density, ::density],
-                               data['v10'][::density, ::density],
-                               scale=scale,
-                               alpha=0.8, color='gray')
-
-        an_fc = utils.annotation_forecast(args['ax'], time)
-        an_var = utils.annotation(args['ax'],
-                                  'MSLP [hPa], Winds@10m and Temperature@2m', loc='lower left', fontsize=6)
-        an_run = utils.annotation_run(args['ax'], run)
-
-        if first:
-            plt.colorbar(cs, orientation='horizontal',
-                         label='Temperature [C]', pad=0.03, fraction=0.04)
-
-        if debug:
-            plt.show(block=True)
-        else:
-            plt.savefig(filename, **utils.options_savefig)
-
-        utils.remove_collections([cs, cs2, c, labels, labels2,
-                                  an_fc, an_var, an_run, cv, maxlabels, minlabels])
-
-        first = False
-
+"""Temperature at 2 m, winds at 10 m and MSLP (products.py)"""
+import render
 
 if __name__ == "__main__":
-    import time
-    start_time = time.time()
-    main()
-    elapsed_time = time.time()-start_time
-    utils.print_message("script took " + time.strftime("%H:%M:%S",
-                                                       time.gmtime(elapsed_time)))
+    render.run('t_v_pres')
@@ -0,0 +1,5 @@
+"""Change of the temperature at 2 m since the previous run (products.py)"""
+import render
+
+if __name__ == "__main__":
+    render.run('t2m_diff')
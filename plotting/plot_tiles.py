@@ -0,0 +1,184 @@
+import numpy as np
+import xarray as xr
+from multiprocessing import Pool
+from functools import partial
+import hashlib
+import json
+import os
+import utils
+import sys
+from PIL import Image
+from computations import compute_wind_speed
+from inputs import tile_inputs
+import raster
+
+# Renders XYZ web-mercator tiles for the regional domains, colouring the fields
+# directly with the colormap lookup tables instead of going through contourf.
+# Usage: python plot_tiles.py <projection> [product ...]
+
+tile_size = 256
+
+# Zoom levels rendered for every domain
+zoom_levels = {
+    'euratl': [3, 4, 5],
+    'it': [5, 6, 7],
+    'de': [5, 6, 7],
+}
+
+tile_products = {
+    'precip_acc': dict(variables=tile_inputs['precip_acc'], var='tp', units='mm',
+                       cmap='rain_acc_wxcharts', extend='max',
+                       levels=list(np.arange(1, 50, 0.4)) +
+                       list(np.arange(51, 100, 2)) +
+                       list(np.arange(101, 200, 3)) +
+                       list(np.arange(201, 500, 6)) +
+                       list(np.arange(501, 1000, 50)) +
+                       list(np.arange(1001, 2000, 100))),
+    't2m': dict(variables=tile_inputs['t2m'], var='t2m',
+                units='degC', cmap='temp', extend='both',
+                levels=np.arange(-40, 50, 1)),
+    'winds10m': dict(variables=tile_inputs['winds10m'], var='wind_speed',
+                     units='kph', cmap='winds_wxcharts', extend='max',
+                     levels=np.linspace(0, 150., 178)),
+}
+
+utils.print_message('Starting script to plot tiles')
+
+if not sys.argv[1:]:
+    utils.print_message(
+        'Projection not defined, falling back to default (euratl)')
+    projection = 'euratl'
+else:
+    projection = sys.argv[1]
+products = sys.argv[2:] or list(tile_products.keys())
+
+
+def get_lut(product):
+    """Lookup table for a product from the same colormaps used by the plots"""
+    options = tile_products[product]
+    if options['cmap'] in ['temp']:
+        cmap, norm = utils.get_colormap(options['cmap']), None
+    else:
+        cmap, norm = utils.get_colormap_norm(options['cmap'], levels=options['levels'])
+
+    return raster.build_lut(options['levels'], cmap, norm, options['extend'])
+
+
+def tile_bounds(zoom):
+    """Range of tiles x, y covering the domain at zoom"""
+    proj_options = utils.proj_defs[projection]
+    n = 2 ** zoom
+
+    def tile_x(lon):
+        return int(np.floor((lon + 180.) / 360. * n))
+
+    def tile_y(lat):
+        lat = np.radians(lat)
+        return int(np.floor((1. - np.arcsinh(np.tan(lat)) / np.pi) / 2. * n))
+
+    return (range(tile_x(proj_options['llcrnrlon']), tile_x(proj_options['urcrnrlon']) + 1),
+            range(tile_y(proj_options['urcrnrlat']), tile_y(proj_options['llcrnrlat']) + 1))
+
+
+def tile_lonlat(zoom, x, y):
+    """Longitude and latitude of the pixel centers of tile (zoom, x, y)"""
+    n = tile_size * 2 ** zoom
+    pixels = np.arange(tile_size) + 0.5
+    lon = (x * tile_size + pixels) / n * 360. - 180.
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1. - 2. * (y * tile_size + pixels) / n))))
+
+    return lon, lat
+
+
+def plot_step(step_data, lons, lats, lut, levels, product):
+    """Render all the tiles of one step. Tiles that are completely transparent are not written,
+    and tiles whose content did not change since they were last written are left untouched."""
+    cum_hour, values = step_data
+    folder = f'{utils.folder_images}tiles/{projection}/{product}/{cum_hour}'
+    manifest_file = folder + '/manifest.json'
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+
+    counts = {'written': 0, 'unchanged': 0, 'empty': 0}
+    for zoom in zoom_levels[projection]:
+        xs, ys = tile_bounds(zoom)
+        for x in xs:
+            for y in ys:
+                lon, lat = tile_lonlat(zoom, x, y)
+                ilon = raster.nearest_index(lons, lon, periodic=True)
+                ilat = raster.nearest_index(lats, lat)
+                tile = values[np.clip(ilat, 0, None)[:, None], ilon[None, :]]
+                tile[ilat < 0, :] = np.nan
+                rgba = raster.apply_lut(tile, levels, lut)
+                key = f'{zoom}/{x}/{y}'
+                if not rgba[..., 3].any():
+                    manifest.pop(key, None)
+                    counts['empty'] += 1
+                    continue
+                digest = hashlib.md5(rgba.tobytes()).hexdigest()
+                filename = f'{folder}/{key}.png'
+                if manifest.get(key) == digest and os.path.isfile(filename):
+                    counts['unchanged'] += 1
+                    continue
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                Image.fromarray(rgba, 'RGBA').save(filename)
+                manifest[key] = digest
+                counts['written'] += 1
+
+    os.makedirs(folder, exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+
+    return counts
+
+
+def read_steps(product):
+    """Read the field of a product one step (GRIB message) at a time"""
+    options = tile_products[product]
+    catalogue = utils.get_catalogue()
+    for step in catalogue['variables'][options['variables'][0]]['steps']:
+        if utils.plot_steps and step not in utils.plot_steps:
+            continue
+        data = xr.merge([utils.read_field(variable, step) for variable in options['variables']])
+        if options['var'] == 'wind_speed':
+            data = compute_wind_speed(data, uvar='u10', vvar='v10')
+        var = data[options['var']].metpy.convert_units(options['units']).metpy.dequantify()
+        _, _, cum_hour = utils.get_time_run_cum(data)
+        yield cum_hour, var.values
+
+
+def main():
+    field = utils.read_field('msl', utils.get_catalogue()['variables']['msl']['steps'][0])
+    lons, lats = field['longitude'].values, field['latitude'].values
+
+    p = Pool(utils.processes)
+    for product in products:
+        levels = np.asarray(tile_products[product]['levels'], dtype='float64')
+        plot_step_param = partial(plot_step, lons=lons, lats=lats,
+                                  lut=get_lut(product), levels=levels, product=product)
+        start_time = time.time()
+        counts = {'written': 0, 'unchanged': 0, 'empty': 0}
+        for step_counts in p.imap(plot_step_param, read_steps(product)):
+            for key in counts:
+                counts[key] += step_counts[key]
+        elapsed_time = time.time() - start_time
+        total = sum(counts.values())
+        utils.print_message('%s: %d tiles (%d written, %d unchanged, %d empty) in %.1fs, %.0f tiles/s' %
+                            (product, total, counts['written'], counts['unchanged'], counts['empty'],
+                             elapsed_time, total / elapsed_time))
+        if utils.run_id:
+            utils.publish(f'{utils.folder_images}tiles/{projection}/{product}',
+                          f'tiles/{projection}/{product}')
+
+
+if __name__ == "__main__":
+    import time
+    start_time = time.time()
+    main()
+    elapsed_time = time.time()-start_time
+    utils.print_peak_rss()
+    utils.print_message("script took " + time.strftime("%H:%M:%S",
+                                                       time.gmtime(elapsed_time)))
@@ -0,0 +1,195 @@
+"""Definition of the products drawn by render.py. Every product is described
+only by what it shows:
+
+    inputs       variables read from the run (names from the catalogue), declared
+                 in inputs.py so that download_data.py can read them
+    units        conversions of the inputs (or derived fields)
+    difference   inputs compared with the previous run: <name>_diff is the
+                 change at the same valid time (see archive.py)
+    accumulated  inputs accumulated from the start of the run (e.g. tp), drawn as
+                 the accumulation over the last `interval` hours, with its mean rate
+                 per hour as <name>_rate: only the steps at the end of the intervals
+                 are drawn (see computations.interval_steps), and the workers
+                 difference them one step at a time
+    derived      functions of the dataset adding the fields that are not in the
+                 run, applied on the area of the projection (see computations.py)
+    background   options of m.drawmapboundary / m.fillcontinents, if any
+    layers       drawn in this order on every step, see render.draw_layer
+    annotation   description of the product in the lower left corner
+    colorbar     options of the colorbar of the filled layer
+
+The levels of a layer are either fixed or, with levels_step, taken from the
+statistics of the whole run (see utils.get_levels_from_stats), so that they're
+the same on every projection. A contour layer with a cache name is computed once
+for all the projections when the contour cache is enabled (see contours.py).
+
+Adding a product only needs an entry here and, to be run by the orchestrator,
+a line in orchestrator.scripts: `python render.py <product> <projection>`
+renders it."""
+import numpy as np
+from matplotlib import patheffects
+from computations import compute_wind_speed
+from inputs import product_inputs
+
+
+def interval_precipitation(interval):
+    """Precipitation in the last interval hours and MSLP"""
+    return dict(
+        inputs=product_inputs['precip_%dh' % interval],
+        units={'msl': 'hPa', 'tp': 'mm'},
+        accumulated=['tp'],
+        interval=interval,
+        background=dict(boundary=dict(fill_color='whitesmoke'),
+                        continents=dict(color='lightgray', lake_color='whitesmoke', zorder=1)),
+        layers=[
+            dict(type='filled', field='tp',
+                 levels=list(np.arange(0.5, 10, 0.5)) +
+                 list(np.arange(10, 30, 1)) +
+                 list(np.arange(30, 100, 5)) +
+                 list(np.arange(100, 300, 25)),
+                 cmap='rain_new', norm=True, extend='max'),
+            dict(type='contour', field='msl', cache='msl', levels_step=5.,
+                 colors='black', linewidths=0.5, antialiased=True,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+        ],
+        annotation='Precipitation in the last %dh [mm] and MSLP [hPa]' % interval,
+        colorbar=dict(label='Precipitation [mm]', pad=0.03, fraction=0.04),
+    )
+
+
+products = {
+    'winds_jet': dict(
+        inputs=product_inputs['winds_jet'],
+        derived=[compute_wind_speed],
+        drop=['u', 'v'],
+        background=dict(continents=dict(color='lightgray', lake_color='whitesmoke', zorder=0)),
+        layers=[
+            dict(type='filled', field='wind_speed', levels=np.arange(80., 300., 10.),
+                 cmap='CMRmap_r', truncate=(0., 0.9), extend='max'),
+            dict(type='contour', field='gh', cache='gh_250', levels=np.arange(8800., 11300., 100.),
+                 colors='black', linewidths=0.5,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+            dict(type='maxmin', field='gh', extrema='min', nsize=60, symbol='L', color='coral'),
+        ],
+        annotation='Winds [kph] and geopotential [m] @250hPa',
+        colorbar=dict(label='Wind', pad=0.03, fraction=0.03),
+    ),
+    'precip_acc': dict(
+        inputs=product_inputs['precip_acc'],
+        units={'msl': 'hPa', 'tp': 'mm'},
+        background=dict(boundary=dict(fill_color='whitesmoke'),
+                        continents=dict(color='lightgray', lake_color='whitesmoke', zorder=1)),
+        layers=[
+            dict(type='filled', field='tp',
+                 levels=list(np.arange(1, 50, 0.4)) +
+                 list(np.arange(51, 100, 2)) +
+                 list(np.arange(101, 200, 3)) +
+                 list(np.arange(201, 500, 6)) +
+                 list(np.arange(501, 1000, 50)) +
+                 list(np.arange(1001, 2000, 100)),
+                 cmap='rain_acc_wxcharts', norm=True, extend='max'),
+            dict(type='contour', field='msl', cache='msl', levels_step=5.,
+                 colors='black', linewidths=0.5, antialiased=True,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+            dict(type='maxmin', field='msl', extrema='max', nsize=60, symbol='H', color='royalblue'),
+            dict(type='maxmin', field='msl', extrema='min', nsize=60, symbol='L', color='coral'),
+        ],
+        annotation='Accumulated precipitation [mm] and MSLP [hPa]',
+        colorbar=dict(label='Accumulated precipitation [mm]', pad=0.03, fraction=0.04),
+    ),
+    'precip_3h': interval_precipitation(3),
+    'precip_6h': interval_precipitation(6),
+    'precip_24h': interval_precipitation(24),
+    'gph_500': dict(
+        inputs=product_inputs['gph_500'],
+        units={'t': 'degC'},
+        layers=[
+            dict(type='filled', field='t', levels=np.arange(-40., 36., 2.),
+                 cmap='temp_meteociel', extend='both'),
+            dict(type='contour', field='t', levels=np.arange(-32., 34., 4.),
+                 colors='gray', linestyles='solid', linewidths=0.3,
+                 # The 0 isotherm is thicker
+                 highlight=dict(level=0., linewidth=1.5),
+                 clabel=dict(fmt='%4.0f', fontsize=7,
+                             path_effects=[patheffects.withStroke(linewidth=0.5, foreground="w")])),
+            dict(type='contour', field='gh', cache='gh_500', levels=np.arange(4700., 6000., 70.),
+                 colors='white', linewidths=1.5,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+            dict(type='maxmin', field='gh', extrema='max', nsize=50, symbol='H', color='royalblue'),
+            dict(type='maxmin', field='gh', extrema='min', nsize=50, symbol='L', color='coral'),
+        ],
+        annotation='Geopotential height @500hPa [m] and temperature @850hPa [C]',
+        colorbar=dict(label='Temperature', pad=0.03, fraction=0.035),
+    ),
+    'winds10m': dict(
+        inputs=product_inputs['winds10m'],
+        units={'msl': 'hPa'},
+        derived=[lambda dset: compute_wind_speed(dset, uvar='u10', vvar='v10')],
+        background=dict(boundary=dict(fill_color='whitesmoke'),
+                        continents=dict(color='lightgray', lake_color='whitesmoke', zorder=1)),
+        layers=[
+            dict(type='filled', field='wind_speed', levels=np.linspace(0, 150., 178),
+                 cmap='winds_wxcharts', norm=True, extend='max'),
+            dict(type='contour', field='msl', cache='msl', levels_step=5.,
+                 colors='black', linewidths=0.5,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+            dict(type='maxmin', field='msl', extrema='max', nsize=60, symbol='H', color='royalblue'),
+            dict(type='maxmin', field='msl', extrema='min', nsize=60, symbol='L', color='coral'),
+            # Spacing of the vectors in pixels, see thinning.py
+            dict(type='quiver', u='u10', v='v10', spacing=15, scale=4e2, scale_world=6e2,
+                 alpha=0.5, color='gray', headwidth=2),
+        ],
+        annotation='Winds@10m [km/h] and MSLP [hPa]',
+        colorbar=dict(label='Wind [km/h]', pad=0.03, fraction=0.03),
+    ),
+    't_v_pres': dict(
+        inputs=product_inputs['t_v_pres'],
+        units={'t2m': 'degC', 'msl': 'hPa'},
+        layers=[
+            dict(type='filled', field='t2m', levels=np.arange(-40, 50, 1),
+                 cmap='temp', extend='both'),
+            dict(type='contour', field='t2m', levels=np.arange(-40, 50, 5),
+                 linewidths=0.3, colors='gray', alpha=0.7,
+                 clabel=dict(fmt='%2.0f', fontsize=7)),
+            dict(type='contour', field='msl', cache='msl', levels_step=4.,
+                 colors='white', linewidths=1.,
+                 clabel=dict(fmt='%4.0f', fontsize=6)),
+            dict(type='maxmin', field='msl', extrema='max', nsize=60, symbol='H', color='royalblue'),
+            dict(type='maxmin', field='msl', extrema='min', nsize=60, symbol='L', color='coral'),
+            dict(type='quiver', u='u10', v='v10', spacing=28, scale=5e2,
+                 alpha=0.8, color='gray'),
+        ],
+        annotation='MSLP [hPa], Winds@10m and Temperature@2m',
+        colorbar=dict(label='Temperature [C]', pad=0.03, fraction=0.04),
+    ),
+    'msl_diff': dict(
+        inputs=product_inputs['msl_diff'],
+        units={'msl': 'hPa'},
+        difference=['msl'],
+        layers=[
+            dict(type='filled', field='msl_diff', levels=np.arange(-20., 21., 1.),
+                 cmap='RdBu_r', extend='both'),
+            dict(type='contour', field='msl', cache='msl', levels_step=5.,
+                 colors='black', linewidths=0.5,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+            dict(type='maxmin', field='msl', extrema='max', nsize=60, symbol='H', color='royalblue'),
+            dict(type='maxmin', field='msl', extrema='min', nsize=60, symbol='L', color='coral'),
+        ],
+        annotation='MSLP [hPa] and its change since the previous run',
+        colorbar=dict(label='MSLP change [hPa]', pad=0.03, fraction=0.04),
+    ),
+    't2m_diff': dict(
+        inputs=product_inputs['t2m_diff'],
+        units={'t2m': 'degC', 'msl': 'hPa'},
+        difference=['t2m'],
+        layers=[
+            dict(type='filled', field='t2m_diff', levels=np.arange(-10., 10.5, 0.5),
+                 cmap='RdBu_r', extend='both'),
+            dict(type='contour', field='msl', cache='msl', levels_step=5.,
+                 colors='black', linewidths=0.5,
+                 clabel=dict(fmt='%4.0f', fontsize=5)),
+        ],
+        annotation='Temperature@2m change since the previous run [C] and MSLP [hPa]',
+        colorbar=dict(label='Temperature change [C]', pad=0.03, fraction=0.04),
+    ),
+}
@@ -0,0 +1,112 @@
+"""Instrumentation of the plotting loops, enabled with PROFILE_FRAMES=true.
+For every frame drawn by a worker it records the time, the resident memory
+and the number of artists left on the axes after remove_collections, and
+takes a tracemalloc snapshot. At the end of the loop (see report) it warns
+when something grows from one frame to the next:
+
+- artists that are not removed (e.g. a collection that remove_collections
+  only reported as empty), listed by type;
+- memory, with the lines of code that allocated most of the growth;
+- the time per frame.
+
+The first frame is not considered, as it also fills the caches (colorbar,
+text outlines...). benchmark.py frames runs the products with this enabled and
+fails when the time or memory per frame trends upward."""
+import os
+import time
+import tracemalloc
+from collections import Counter
+import numpy as np
+import utils
+
+# Frames of the current loop: dicts with time, rss, artists, snapshot
+frames = []
+# Result of the last report, see benchmark.py frames
+latest = {}
+# Relative growth over the loop that is flagged (time and memory)
+max_growth = 0.2
+# Number of lines shown for the memory growth
+top_lines = 5
+
+
+def get_rss():
+    """Current resident memory of the process in MB"""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024. ** 2
+
+
+def frame_start():
+    """Call before drawing a frame"""
+    if not utils.profile_frames:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    frames.append(dict(start=time.perf_counter()))
+
+
+def frame_end(ax):
+    """Call after the frame has been saved and its artists removed"""
+    if not utils.profile_frames:
+        return
+    frame = frames[-1]
+    frame['time'] = time.perf_counter() - frame.pop('start')
+    frame['rss'] = get_rss()
+    frame['artists'] = Counter(type(a).__name__ for a in ax.get_children())
+    frame['snapshot'] = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)])
+    # Only the first frame after the warm up and the last one are compared
+    if len(frames) > 1:
+        frames[0].pop('snapshot', None)
+    if len(frames) > 3:
+        frames[-2].pop('snapshot', None)
+
+
+def growth(values):
+    """Increase of values over the loop according to a linear fit,
+    relative to their median"""
+    if len(values) < 3:
+        return 0.
+    slope = np.polyfit(np.arange(len(values)), values, 1)[0]
+
+    return slope * (len(values) - 1) / np.median(values)
+
+
+def report(name):
+    """Print the statistics of the frames of the loop, flag what grows and
+    start again. Returns the growth of time and memory per frame."""
+    if not utils.profile_frames or not frames:
+        return {}
+    loop = frames[1:] if len(frames) > 1 else frames
+    times = [f['time'] for f in loop]
+    rss = [f['rss'] for f in loop]
+    utils.print_message('%s: %d frames, %.3fs/frame (min %.3f, max %.3f), RSS %.0f-%.0f MB' %
+                        (name, len(frames), np.mean(times), np.min(times), np.max(times),
+                         np.min(rss), np.max(rss)))
+
+    leftover = loop[-1]['artists'] - loop[0]['artists']
+    if leftover:
+        utils.print_message('%s: WARNING %d artists left on the axes over %d frames: %s' %
+                            (name, sum(leftover.values()), len(loop),
+                             ', '.join('%s %d' % item for item in leftover.most_common())))
+
+    result = dict(time=growth(times), rss=growth(rss),
+                  artists=sum(leftover.values()))
+    if result['time'] > max_growth:
+        utils.print_message('%s: WARNING the time per frame grows by %.0f%% over the loop' %
+                            (name, 100 * result['time']))
+    if result['rss'] > max_growth:
+        utils.print_message('%s: WARNING the memory grows by %.0f%% over the loop' %
+                            (name, 100 * result['rss']))
+    stats = loop[-1]['snapshot'].compare_to(loop[0]['snapshot'], 'lineno')
+    grown = [stat for stat in stats if stat.size_diff > 0]
+    if result['rss'] > max_growth or result['artists']:
+        for stat in grown[:top_lines]:
+            utils.print_message('%s: +%.1f kB %s' % (name, stat.size_diff / 1024., stat.traceback))
+
+    frames.clear()
+    latest.clear()
+    latest.update(result)
+
+    return result
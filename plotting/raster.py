@@ -0,0 +1,123 @@
+"""Direct rasterisation of fields with a colormap lookup table, without going
+through matplotlib contourf. The colour of every band between two levels is
+precomputed once from the same cmap/norm used by the plotting scripts, so
+colouring a field is just a searchsorted + take on the array."""
+import hashlib
+import os
+import numpy as np
+import matplotlib.colors as colors
+import matplotlib.cm as mplcm
+import utils
+
+
+def build_lut(levels, cmap, norm=None, extend='neither'):
+    """RGBA (uint8) lookup table for the bands defined by levels, following the
+    contourf conventions: index 0 is below levels[0], index i the band
+    [levels[i-1], levels[i]) and the last index is above levels[-1].
+    Values outside of the levels are transparent unless extend says otherwise."""
+    levels = np.asarray(levels, dtype='float64')
+    if norm is None:
+        norm = colors.Normalize(vmin=levels[0], vmax=levels[-1])
+    layers = 0.5 * (levels[:-1] + levels[1:])
+    lut = np.zeros((len(levels) + 1, 4), dtype=np.uint8)
+    lut[1:-1] = cmap(norm(layers), bytes=True)
+    if extend in ['min', 'both']:
+        lut[0] = cmap(norm(np.array([levels[0] - 1.])), bytes=True)[0]
+    if extend in ['max', 'both']:
+        lut[-1] = cmap(norm(np.array([levels[-1] + 1.])), bytes=True)[0]
+
+    return lut
+
+
+def apply_lut(values, levels, lut):
+    """Colour the values with the lookup table built by build_lut.
+    NaNs are transparent."""
+    index = np.searchsorted(levels, values, side='right')
+    rgba = lut[index]
+    rgba[~np.isfinite(values)] = 0
+
+    return rgba
+
+
+def nearest_index(coord, values, periodic=False):
+    """Index of the nearest point of the regular 1D coordinate coord for each
+    of values. Points outside of the coordinate are returned as -1, unless the
+    coordinate is periodic (longitude), in which case they're wrapped around."""
+    step = coord[1] - coord[0]
+    index = np.rint((values - coord[0]) / step).astype(int)
+    if periodic:
+        return index % len(coord)
+    index[(index < 0) | (index >= len(coord))] = -1
+
+    return index
+
+
+def build_projection_index(m, lons, lats, width, height):
+    """Inverse projection of a width x height pixels map drawn with the Basemap
+    instance m: for every pixel, the flat index of the nearest point of the
+    lons/lats grid, or -1 if the pixel is outside of the globe or of the grid."""
+    x, y = np.meshgrid(np.linspace(m.xmin, m.xmax, width),
+                       np.linspace(m.ymin, m.ymax, height))
+    lon, lat = m(x, y, inverse=True)
+    lon, lat = np.asarray(lon), np.asarray(lat)
+    outside = (np.abs(lon) > 1e20) | (np.abs(lat) > 1e20)
+    # Some projections (e.g. kav7) return a valid lon/lat also for pixels outside of
+    # the map boundary: these don't come back to the same pixel when projected again
+    x_back, y_back = m(np.where(outside, 0., lon), np.where(outside, 0., lat))
+    resolution = max((m.xmax - m.xmin) / width, (m.ymax - m.ymin) / height)
+    outside |= (np.abs(x_back - x) > resolution) | (np.abs(y_back - y) > resolution)
+    lon = ((np.where(outside, 0., lon) + 180.) % 360.) - 180.
+    periodic = np.isclose(np.abs(lons[1] - lons[0]) * len(lons), 360.)
+    ilon = nearest_index(lons, lon, periodic=periodic)
+    ilat = nearest_index(lats, np.where(outside, 0., lat))
+    index = ilat * len(lons) + ilon
+    index[outside | (ilat < 0) | (ilon < 0)] = -1
+
+    return index.astype(np.int32)
+
+
+def get_projection_index(projection, m, ax, lons, lats):
+    """build_projection_index for the pixels of ax, cached on disk for every
+    projection and grid since it only depends on the geometry"""
+    bbox = ax.get_window_extent()
+    width, height = int(bbox.width), int(bbox.height)
+    grid_hash = hashlib.md5(np.concatenate([lons, lats]).tobytes()).hexdigest()[:10]
+    # The index doesn't depend on the run, so it's shared between all of them
+    filename = utils.base_folder + 'raster_index/%s_%dx%d_%s.npy' % (
+        projection, width, height, grid_hash)
+    if os.path.isfile(filename):
+        return np.load(filename)
+    index = build_projection_index(m, lons, lats, width, height)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = filename + '.%d.tmp.npy' % os.getpid()
+    np.save(tmp_filename, index)
+    os.replace(tmp_filename, filename)
+
+    return index
+
+
+def render(ax, m, values, index, levels, lut, zorder=1):
+    """Draw values on ax as an image coloured with lut, in place of contourf.
+    zorder 1 is the same as contourf, so that the image stays below
+    the lines and labels overlays."""
+    flat = np.asarray(values, dtype='float64').ravel()
+    pixels = np.where(index >= 0, flat[np.clip(index, 0, None)], np.nan)
+    rgba = apply_lut(pixels, np.asarray(levels, dtype='float64'), lut)
+
+    return ax.imshow(rgba, extent=(m.xmin, m.xmax, m.ymin, m.ymax), origin='lower',
+                     interpolation='nearest', zorder=zorder)
+
+
+def colorbar(levels, cmap, norm=None, **kwargs):
+    """Colorbar for a field drawn with render, with the same bands that
+    contourf would have shown"""
+    import matplotlib.pyplot as plt
+    levels = np.asarray(levels, dtype='float64')
+    if norm is None:
+        norm = colors.Normalize(vmin=levels[0], vmax=levels[-1])
+    # The mappable is not attached to any axes, so steal the space from the current one
+    kwargs.setdefault('ax', plt.gca())
+
+    return plt.colorbar(mplcm.ScalarMappable(norm=norm, cmap=cmap),
+                        boundaries=levels, values=0.5 * (levels[:-1] + levels[1:]),
+                        **kwargs)
@@ -0,0 +1,305 @@
+"""Render engine of the products defined in products.py: reads the inputs,
+prepares the projection and fans the steps out to the workers, which draw the
+layers of the product on the figure inherited from main (see utils.new_figure).
+
+Usage: python render.py <product> [projection]
+
+The plot_*.py scripts only call this with their product."""
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from multiprocessing import Pool
+from functools import partial
+import sys
+import utils
+import contours
+import animations
+import raster
+import thinning
+import labels as fast_labels
+import profiling
+import archive
+import events
+from time import perf_counter
+import pandas as pd
+from products import products
+from computations import interval_steps, interval_accumulations
+
+
+def get_colormap(layer):
+    """Colormap and norm (or None) of a filled layer"""
+    if layer.get('norm'):
+        return utils.get_colormap_norm(layer['cmap'], levels=layer['levels'])
+    if 'truncate' in layer:
+        return utils.truncate_colormap(plt.get_cmap(layer['cmap']), *layer['truncate']), None
+    if layer['cmap'] in plt.colormaps():
+        return plt.get_cmap(layer['cmap']), None
+
+    return utils.get_colormap(layer['cmap']), None
+
+
+def prepare(product, projection):
+    """Read the inputs and compute everything that doesn't depend on the step:
+    returns the dataset on the area of the projection and the arguments
+    of plot_files, or None if the product can't be drawn for this run (a
+    comparison without a previous run, see archive.read_previous)"""
+    spec = products[product]
+    figure = utils.new_figure(projection, product)
+    ax = figure['ax']
+    # Resolution of the decoded store needed by this map, see ingest.py
+    level = utils.get_pyramid_level(projection, ax.get_window_extent().width)
+    accumulated, intervals = None, None
+    if 'accumulated' in spec:
+        # Always lazy: the accumulated inputs are differenced one step at a time
+        # in the workers (see plot_files), the others are read at the end steps only
+        dset = utils.read_dataset(spec['inputs'], level=level, lazy=True, all_steps=True)
+        hours = (dset['step'].values / pd.Timedelta('1 hour')).astype(int)
+        intervals = [interval for interval in interval_steps(hours, spec['interval'])
+                     if not utils.plot_steps or interval[1] in utils.plot_steps]
+        accumulated = dset[spec['accumulated']]
+        dset = dset.drop_vars(spec['accumulated']).sel(
+            step=pd.to_timedelta([end for _, end in intervals], unit='h'))
+    else:
+        dset = utils.read_dataset(spec['inputs'], level=level)
+    previous = None
+    if 'difference' in spec:
+        # Same valid times of the previous run, see archive.py
+        compared = archive.read_previous(spec['inputs'], dset, level)
+        if compared is None:
+            return None
+        dset, previous = compared
+    for name, units in spec.get('units', {}).items():
+        if accumulated is not None and name in accumulated:
+            accumulated[name] = accumulated[name].metpy.convert_units(units).metpy.dequantify()
+            continue
+        dset[name] = dset[name].metpy.convert_units(units).metpy.dequantify()
+        if previous is not None and name in previous:
+            previous[name] = previous[name].metpy.convert_units(units).metpy.dequantify()
+    for name in spec.get('difference', []):
+        dset[name + '_diff'] = dset[name] - previous[name].data
+
+    m, x, y, mask = utils.get_projection(dset, projection)
+    figure['m'] = m
+
+    layers = []
+    for layer in spec['layers']:
+        layer = dict(layer)
+        if 'levels_step' in layer:
+            # Same levels for every projection, from the statistics of the whole run
+            layer['levels'] = utils.get_levels_from_stats(layer['field'], layer.pop('levels_step'),
+                                                          dset[layer['field']])
+        if 'cache' in layer and level > 0:
+            # The cached contours are shared only by the maps at the same resolution
+            layer['cache'] = '%s_level%d' % (layer['cache'], level)
+        if utils.contour_cache and 'cache' in layer:
+            contours.precompute(dset[layer['field']], layer['cache'], layer['levels'])
+        layers.append(layer)
+
+    # Subset dataset only on the area
+    dset = dset.where(mask, drop=True)
+    if accumulated is not None:
+        accumulated = accumulated.where(mask, drop=True)
+    for compute in spec.get('derived', []):
+        dset = compute(dset)
+    dset = dset.drop_vars(spec.get('drop', []))
+    if 'boundary' in spec.get('background', {}):
+        m.drawmapboundary(**spec['background']['boundary'])
+    if 'continents' in spec.get('background', {}):
+        m.fillcontinents(**spec['background']['continents'])
+    if not utils.streaming and accumulated is None:
+        dset = dset.load()
+
+    for layer in layers:
+        if layer['type'] == 'filled':
+            layer['cmap'], layer['norm'] = get_colormap(layer)
+            layer.pop('truncate', None)
+            if product in utils.raster_products:
+                layer['raster_index'] = raster.get_projection_index(projection, m, ax,
+                                                                    dset['longitude'].values,
+                                                                    dset['latitude'].values)
+                layer['lut'] = raster.build_lut(layer['levels'], layer['cmap'], layer['norm'],
+                                                extend=layer['extend'])
+        elif layer['type'] == 'quiver':
+            # Points where the vectors are drawn, evenly spaced on the map
+            layer['index'] = thinning.get_thinning_index(projection, m, ax, x, y,
+                                                         spacing=layer.pop('spacing'))
+            scale_world = layer.pop('scale_world', layer['scale'])
+            if projection == 'world':
+                layer['scale'] = scale_world
+
+    return dset, dict(x=x, y=y, layers=layers, intervals=intervals, accumulated=accumulated)
+
+
+def draw_layer(ax, m, x, y, data, layer, raster_product):
+    """Draw a layer of a product, returning the artists to remove
+    afterwards and the mappable for the colorbar, if any"""
+    options = {k: v for k, v in layer.items() if k not in
+               ['type', 'field', 'cache', 'clabel', 'highlight', 'raster_index', 'lut',
+                'u', 'v', 'index', 'extrema', 'nsize', 'symbol']}
+    if layer['type'] == 'filled':
+        if raster_product:
+            cs = raster.render(ax, m, data[layer['field']], layer['raster_index'],
+                               layer['levels'], layer['lut'])
+        else:
+            cs = ax.contourf(x, y, data[layer['field']], **options)
+        return [cs], cs
+
+    if layer['type'] == 'contour':
+        if 'cache' in layer:
+            c = contours.contour(ax, m, x, y, data[layer['field']], layer['cache'], **options)
+        else:
+            c = ax.contour(x, y, data[layer['field']], **options)
+        if 'highlight' in layer:
+            widths = [layer['highlight']['linewidth'] if level == layer['highlight']['level']
+                      else options.get('linewidths') for level in c.levels]
+            try:
+                c.set_linewidth(widths)
+            except AttributeError:
+                # Before matplotlib 3.8 every level is a separate collection
+                for coll, width in zip(c.collections, widths):
+                    coll.set_linewidth(width)
+        artists = [c]
+        if 'clabel' in layer:
+            clabel = dict(layer['clabel'])
+            path_effects = clabel.pop('path_effects', None)
+            if utils.fast_labels:
+                labels = fast_labels.clabel(ax, c, layer.get('cache', layer['field']),
+                                            path_effects=path_effects, **clabel)
+            else:
+                labels = ax.clabel(c, c.levels, inline=True, **clabel)
+                if path_effects:
+                    plt.setp(labels, path_effects=path_effects)
+            artists.append(labels)
+        return artists, None
+
+    if layer['type'] == 'maxmin':
+        return [utils.plot_maxmin_points(ax, x, y, data[layer['field']], layer['extrema'],
+                                         layer['nsize'], symbol=layer['symbol'],
+                                         color=options['color'], random=True)], None
+
+    if layer['type'] == 'quiver':
+        cv = ax.quiver(*thinning.thin(layer['index'], x, y, data[layer['u']], data[layer['v']]),
+                       **options)
+        return [cv], None
+
+    raise ValueError('Unknown layer type %s' % layer['type'])
+
+
+def read_step(field, step):
+    """A single step (in hours) of a lazy field"""
+    return field.sel(step=pd.Timedelta(hours=step)).load()
+
+
+def plot_files(dss, product, projection, **args):
+    # The figure is set up in main() and inherited by the workers, see utils.new_figure
+    figure = utils.get_figure(projection, product)
+    ax, m = figure['ax'], figure['m']
+    spec = products[product]
+    raster_product = product in utils.raster_products
+    accumulations = None
+    if args['accumulated'] is not None:
+        # The intervals ending at the steps of this chunk, one generator per variable
+        hours = (dss['step'].values / pd.Timedelta('1 hour')).astype(int)
+        intervals = [interval for interval in args['intervals'] if interval[1] in hours]
+        accumulations = zip(*[interval_accumulations(partial(read_step, args['accumulated'][name]),
+                                                     intervals)
+                              for name in args['accumulated'].data_vars])
+    frames = []
+    for time_sel in dss.step:
+        profiling.frame_start()
+        frame_start = perf_counter()
+        # No-op unless streaming, in which case only this step is read from disk
+        data = dss.sel(step=time_sel).load()
+        if accumulations is not None:
+            for _, _, accumulation, rate in next(accumulations):
+                data[accumulation.name] = accumulation.variable
+                data[rate.name] = rate.variable
+        time, run, cum_hour = utils.get_time_run_cum(data)
+        # Build the name of the output image
+        filename = utils.product_folder(projection, product) + \
+            '/' + product + '_%s.png' % cum_hour
+
+        artists, mappable = [], None
+        for layer in args['layers']:
+            layer_artists, layer_mappable = draw_layer(ax, m, args['x'], args['y'], data,
+                                                       layer, raster_product)
+            artists += layer_artists
+            if mappable is None:
+                mappable = layer_mappable
+
+        artists.append(utils.annotation_forecast(ax, time))
+        artists.append(utils.annotation(ax, spec['annotation'], loc='lower left', fontsize=6))
+        artists.append(utils.annotation_run(ax, run))
+
+        if 'colorbar' not in figure:
+            filled = [layer for layer in args['layers'] if layer['type'] == 'filled'][0]
+            if raster_product:
+                figure['colorbar'] = raster.colorbar(filled['levels'], filled['cmap'], filled['norm'],
+                                                     orientation='horizontal',
+                                                     extend=filled['extend'], **spec['colorbar'])
+            else:
+                figure['colorbar'] = plt.colorbar(mappable, orientation='horizontal',
+                                                  **spec['colorbar'])
+
+        png = utils.save_figure(filename)
+        if png is not None:
+            frames.append((cum_hour, png))
+
+        utils.remove_collections(artists)
+        profiling.frame_end(ax)
+        events.log('frame', stage='render', step=int(cum_hour),
+                   duration=round(perf_counter() - frame_start, 3))
+
+    profiling.report('%s %s' % (product, projection))
+
+    return frames
+
+
+def main(product, projection):
+    # Fields of all the events of this product, see events.py
+    events.context.update(product=product, projection=projection)
+    utils.print_message('Starting script to plot ' + product)
+    prepared = prepare(product, projection)
+    if prepared is None:
+        utils.print_message('Nothing to compare %s with, skipping' % product)
+        return
+    dset, args = prepared
+
+    utils.print_message('Pre-processing finished, launching plotting scripts')
+    # Parallelize the plotting by dividing into chunks and processes
+    dss = utils.chunks_dataset(dset, utils.chunks_size)
+    plot_files_param = partial(plot_files, product=product, projection=projection, **args)
+    p = Pool(utils.processes)
+    frames = p.map(plot_files_param, dss)
+    if utils.animation_formats:
+        animations.write_outputs([f for chunk in frames for f in chunk],
+                                 product, projection)
+    utils.publish_product(projection, product)
+
+
+def run(product):
+    """Entry point of the plot_*.py scripts, the projection is the first argument"""
+    import time
+    # Get the projection as system argument from the call so that we can
+    # span multiple instances of this script outside
+    if not sys.argv[1:]:
+        utils.print_message(
+            'Projection not defined, falling back to default (nh)')
+        projection = 'nh'
+    else:
+        projection = sys.argv[1]
+    start_time = time.time()
+    main(product, projection)
+    elapsed_time = time.time()-start_time
+    utils.print_peak_rss()
+    utils.print_message(
+        "script took " + time.strftime("%H:%M:%S", time.gmtime(elapsed_time)),
+        duration=round(elapsed_time, 3))
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] not in products:
+        utils.print_message('Usage: python render.py <%s> [projection]' % '|'.join(products))
+        sys.exit(1)
+    product = sys.argv.pop(1)
+    run(product)
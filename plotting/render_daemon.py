@@ -0,0 +1,235 @@
+"""Long-lived render service. The daemon imports matplotlib, basemap, metpy and
+cfgrib once, loads the fonts, builds the Basemap instances and an empty figure
+with its axes for all the projections and reads the colormaps, and then runs
+every render job in a process forked from this warm state, so that a job only
+pays for its data.
+Jobs are received on a local socket.
+
+    python render_daemon.py serve                          start the daemon
+    python render_daemon.py submit <script> <projection> [log]   run a job and wait for it
+    python render_daemon.py stop                           stop the daemon
+    python render_daemon.py benchmark <script> <projection>
+
+A job runs the plotting script exactly as `python <script> <projection>` would,
+with the environment of the client (RUN_ID, PLOT_STEPS, ...), so the
+orchestrator uses `submit` in place of the plain command (RENDER_DAEMON=true).
+
+The clients are authenticated with the key in RENDER_DAEMON_KEY or, when it's
+not set, with a random key that the daemon writes next to the socket
+(<socket>.key, readable only by its user) every time it starts."""
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+import os
+import secrets
+import sys
+import time
+
+address = os.environ.get('RENDER_DAEMON_SOCKET', '/tmp/ecmwf-hres-render.sock')
+key_file = address + '.key'
+
+# Maximum number of jobs running at the same time (every job has its own Pool)
+max_jobs = int(os.environ.get('RENDER_DAEMON_JOBS', 4))
+
+
+def print_message(message):
+    """Formatted print, the daemon doesn't import utils until it's serving"""
+    print(os.path.basename(sys.argv[0]) + ' : ' + message, flush=True)
+
+
+def get_authkey(create=False):
+    """Key of the daemon: RENDER_DAEMON_KEY if set, otherwise the one in key_file,
+    which is generated when create is True (i.e. by the daemon)"""
+    if os.environ.get('RENDER_DAEMON_KEY'):
+        return os.environ['RENDER_DAEMON_KEY'].encode()
+    if create:
+        # Removed first, as os.open doesn't change the mode of an existing file
+        if os.path.exists(key_file):
+            os.remove(key_file)
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    with open(key_file, 'r') as f:
+        return f.read().strip().encode()
+
+
+def warm_up():
+    """Import and build everything that doesn't depend on the data: the fonts,
+    the Basemap instances, the colormaps and a figure with its axes for every
+    projection, which the job takes (see utils.new_figure)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import metpy.calc  # noqa: F401
+    import cfgrib  # noqa: F401
+    import utils
+    import contours  # noqa: F401
+    import raster  # noqa: F401
+    import animations  # noqa: F401
+    import computations  # noqa: F401
+    import render  # noqa: F401
+
+    start = time.time()
+    # Load the fonts by drawing some text once
+    fig = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
+    fig.text(0.5, 0.5, 'warm up')
+    fig.canvas.draw()
+    plt.close(fig)
+    for projection in utils.proj_defs:
+        try:
+            utils.get_basemap(projection)
+        except Exception as e:
+            print_message('Cannot build the basemap of %s: %s' % (projection, e))
+        fig = plt.figure(figsize=(utils.figsize_x, utils.figsize_y))
+        ax = plt.gca()
+        # Creates the renderer and the canvas buffer
+        fig.canvas.draw()
+        utils.warm_figures[projection] = {'fig': fig, 'ax': ax}
+    for name in ['prec', 'winds', 'rain_acc_wxcharts', 'snow_wxcharts', 'winds_wxcharts', 'temp']:
+        if os.path.isfile(utils.home_folder + '/plotting/cmap_%s.rgba' % name):
+            utils.read_rgba(name)
+    print_message('Warm up took %.1fs' % (time.time() - start))
+
+
+def run_job(job):
+    """Executed in the forked process: run the script as if it was started from
+    the command line, with the environment of the client"""
+    import runpy
+    import utils
+    import archive
+    if job.get('log'):
+        log = os.open(job['log'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+    os.environ.clear()
+    os.environ.update(job['env'])
+    # The settings of utils were read from the environment of the daemon when it
+    # was imported: apply the ones of the job, keeping what was built during the warm up
+    utils.configure(job['env'])
+    archive.archive_folder = utils.base_folder + 'archive/'
+    os.chdir(job['cwd'])
+    sys.argv = [job['script'], job['projection']]
+    runpy.run_path(job['script'], run_name='__main__')
+
+
+def serve():
+    import multiprocessing
+    import queue
+    import threading
+    from multiprocessing.connection import wait
+    warm_up()
+    context = multiprocessing.get_context('fork')
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, authkey=get_authkey(create=True))
+    connections = queue.Queue()
+
+    def accept():
+        # Only accept here: all the forks happen in the main thread
+        while True:
+            try:
+                connections.put(listener.accept())
+            except (AuthenticationError, EOFError):
+                # A client with the wrong key
+                continue
+    threading.Thread(target=accept, daemon=True).start()
+    print_message('Listening on %s' % address)
+
+    waiting, running = [], {}
+    while True:
+        try:
+            while True:
+                connection = connections.get(timeout=0.1 if not running else 0)
+                try:
+                    job = connection.recv()
+                except (EOFError, OSError):
+                    connection.close()
+                    continue
+                if job == 'ping':
+                    connection.send('pong')
+                    connection.close()
+                    continue
+                if job == 'stop':
+                    connection.send('stopping')
+                    listener.close()
+                    return
+                waiting.append((job, connection))
+        except queue.Empty:
+            pass
+        while waiting and len(running) < max_jobs:
+            job, connection = waiting.pop(0)
+            process = context.Process(target=run_job, args=(job,))
+            process.start()
+            running[process.sentinel] = (process, job, connection, time.time())
+        for sentinel in wait(list(running), timeout=0.1):
+            process, job, connection, start = running.pop(sentinel)
+            process.join()
+            try:
+                connection.send({'exitcode': process.exitcode, 'elapsed': time.time() - start})
+            except OSError:
+                pass
+            connection.close()
+
+
+def submit(script, projection, log=None):
+    """Send a job to the daemon and wait for it, returning its result"""
+    with Client(address, authkey=get_authkey()) as connection:
+        connection.send({'script': script, 'projection': projection, 'log': log,
+                         'cwd': os.getcwd(), 'env': dict(os.environ)})
+        return connection.recv()
+
+
+def stop():
+    with Client(address, authkey=get_authkey()) as connection:
+        connection.send('stop')
+        connection.recv()
+
+
+def wait_ready():
+    """Wait until the daemon is warm and accepting jobs"""
+    while True:
+        try:
+            with Client(address, authkey=get_authkey()) as connection:
+                connection.send('ping')
+                connection.recv()
+            return
+        except (FileNotFoundError, ConnectionRefusedError, AuthenticationError):
+            # Not started yet, or still the key of a previous daemon
+            time.sleep(0.1)
+
+
+def benchmark(script, projection):
+    """Time the same job started cold (a new interpreter) and through the
+    daemon, which is started here and warmed up first"""
+    import subprocess
+    start = time.time()
+    subprocess.run([sys.executable, script, projection], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    elapsed_cold = time.time() - start
+
+    start = time.time()
+    daemon = subprocess.Popen([sys.executable, __file__, 'serve'])
+    wait_ready()
+    elapsed_startup = time.time() - start
+    results = [submit(script, projection, log=os.devnull) for _ in range(2)]
+    stop()
+    daemon.wait()
+
+    print_message('%s %s: cold %.1fs, warm %.1fs and %.1fs (daemon start up %.1fs, once)' %
+                  (script, projection, elapsed_cold, results[0]['elapsed'],
+                   results[1]['elapsed'], elapsed_startup))
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if sys.argv[1:] else None
+    if command == 'serve':
+        serve()
+    elif command == 'submit' and len(sys.argv) in [4, 5]:
+        result = submit(*sys.argv[2:])
+        sys.exit(result['exitcode'])
+    elif command == 'stop':
+        stop()
+    elif command == 'benchmark' and len(sys.argv) == 4:
+        benchmark(sys.argv[2], sys.argv[3])
+    else:
+        print_message(__doc__)
+        sys.exit(1)
@@ -0,0 +1,59 @@
+"""Thinning of the grid points where vectors (quiver, barbs) are drawn, so that
+they're evenly spaced on the map whatever the projection. Striding the lat/lon
+grid (e.g. [::5, ::5]) gives denser arrows where the meridians converge
+(near the poles on nsper/nplaea) and sparser ones elsewhere; instead the map
+is divided into square bins of a given size in pixels and in every bin only
+the grid point closest to its center is kept."""
+import hashlib
+import os
+import numpy as np
+import utils
+
+
+def build_thinning_index(m, x, y, width, height, spacing):
+    """Flat indices of the points of x, y (projected coordinates of the grid)
+    to keep on a width x height pixels map drawn with the Basemap instance m,
+    one every spacing pixels"""
+    x, y = np.asarray(x, dtype='float64').ravel(), np.asarray(y, dtype='float64').ravel()
+    cell = spacing * max((m.xmax - m.xmin) / width, (m.ymax - m.ymin) / height)
+    inside = np.isfinite(x) & np.isfinite(y) & \
+        (x >= m.xmin) & (x <= m.xmax) & (y >= m.ymin) & (y <= m.ymax)
+    points = np.flatnonzero(inside)
+    if points.size == 0:
+        # The grid doesn't cover the map
+        return np.empty(0, dtype=np.int32)
+    ix = np.floor((x[points] - m.xmin) / cell).astype(np.int64)
+    iy = np.floor((y[points] - m.ymin) / cell).astype(np.int64)
+    distance = np.hypot(x[points] - m.xmin - (ix + 0.5) * cell,
+                        y[points] - m.ymin - (iy + 0.5) * cell)
+    bins = iy * (ix.max() + 1) + ix
+    # Sort by bin and then by distance from the center: the first point of every bin is kept
+    order = np.lexsort((distance, bins))
+    _, first = np.unique(bins[order], return_index=True)
+
+    return np.sort(points[order[first]]).astype(np.int32)
+
+
+def get_thinning_index(projection, m, ax, x, y, spacing):
+    """build_thinning_index for the pixels of ax, cached on disk for every
+    projection, grid and spacing since it only depends on the geometry"""
+    bbox = ax.get_window_extent()
+    width, height = int(bbox.width), int(bbox.height)
+    grid_hash = hashlib.md5(np.nan_to_num(np.asarray(x, dtype='float64')).tobytes() +
+                            np.nan_to_num(np.asarray(y, dtype='float64')).tobytes()).hexdigest()[:10]
+    filename = utils.base_folder + 'thinning/%s_%dx%d_%d_%s.npy' % (
+        projection, width, height, spacing, grid_hash)
+    if os.path.isfile(filename):
+        return np.load(filename)
+    index = build_thinning_index(m, x, y, width, height, spacing)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = filename + '.%d.tmp.npy' % os.getpid()
+    np.save(tmp_filename, index)
+    os.replace(tmp_filename, filename)
+
+    return index
+
+
+def thin(index, *fields):
+    """The values of fields (2D arrays on the same grid) at the thinned points"""
+    return [np.asarray(field).ravel()[index] for field in fields]
@@ -12,10 +12,11 @@ from glob import glob
 import xarray as xr
 from matplotlib.offsetbox import AnnotationBbox, OffsetImage
 import metpy
-import re
 import requests
 import json
+import io
 from matplotlib.image import imread as read_png
+import events
 
 import warnings
 warnings.filterwarnings(
@@ -31,12 +32,95 @@ if 'MODEL_DATA_FOLDER' in os.environ:
 else:
     folder = '/home/ekman/ssd/guido/ecmwf-hres/'
 
-folder_images = folder
+# Run-scoped layout: with RUN_ID set (e.g. RUN_ID=2026101900) the data and the
+# images of every run are kept in their own folder, runs/<RUN_ID>/, and the
+# completed products are published by swapping a symlink in published/
+# (see publish_product). A new run can then be downloaded and rendered
+# while the previous one is still being served and uploaded.
+base_folder = folder
+run_id = os.environ.get('RUN_ID')
+published_folder = base_folder + 'published/'
+if run_id:
+    folder = base_folder + 'runs/%s/' % run_id
+    folder_images = folder + 'images/'
+else:
+    folder_images = folder
 chunks_size = 10
 processes = 4
 figsize_x = 12
 figsize_y = 9
 
+# Compute the contour lines once in lon/lat space and share them between
+# the projections (see contours.py)
+if 'CONTOUR_CACHE' in os.environ:
+    contour_cache = os.environ['CONTOUR_CACHE'].lower() in ['1', 'true', 'yes']
+else:
+    contour_cache = False
+
+# Place the contour labels with labels.clabel instead of ax.clabel, reusing
+# the positions of the previous step (see labels.py)
+if 'FAST_LABELS' in os.environ:
+    fast_labels = os.environ['FAST_LABELS'].lower() in ['1', 'true', 'yes']
+else:
+    fast_labels = False
+
+# Record time, memory and artists of every frame drawn by the workers and
+# warn when they grow along the loop (see profiling.py)
+if 'PROFILE_FRAMES' in os.environ:
+    profile_frames = os.environ['PROFILE_FRAMES'].lower() in ['1', 'true', 'yes']
+else:
+    profile_frames = False
+
+# Read the fields from the decoded store written by ingest.py, at the
+# resolution needed by every projection
+if 'DECODED_STORE' in os.environ:
+    decoded_store = os.environ['DECODED_STORE'].lower() in ['1', 'true', 'yes']
+else:
+    decoded_store = False
+# Maximum distance in pixels between the grid points of the level read for a map
+pyramid_max_spacing = 2.
+# Decoded stores of the previous runs kept for the comparisons (see archive.py):
+# at most archive_runs runs, none older than archive_max_days before the latest,
+# archive_max_gb in total
+archive_runs = int(os.environ.get('ARCHIVE_RUNS', 4))
+archive_max_days = int(os.environ.get('ARCHIVE_MAX_DAYS', 3))
+archive_max_gb = float(os.environ.get('ARCHIVE_MAX_GB', 20))
+
+# Streaming mode: the datasets are opened lazily and every worker only loads
+# streaming_window steps at a time instead of the whole run
+if 'STREAMING' in os.environ:
+    streaming = os.environ['STREAMING'].lower() in ['1', 'true', 'yes']
+else:
+    streaming = False
+streaming_window = int(os.environ.get('STREAMING_WINDOW', 1))
+if streaming:
+    import dask
+    # The data is read inside the forked Pool workers, where the threads
+    # of the default dask scheduler would deadlock
+    dask.config.set(scheduler='synchronous')
+
+# Animated loops and sprites to assemble from the rendered frames
+# (see animations.py), e.g. ANIMATION_OUTPUT=apng,webp,mp4,sprite
+if 'ANIMATION_OUTPUT' in os.environ:
+    animation_formats = [f for f in os.environ['ANIMATION_OUTPUT'].split(',') if f]
+else:
+    animation_formats = []
+
+# Products (by variable_name) whose filled field is drawn as a raster image
+# coloured with a lookup table instead of contourf (see raster.py),
+# e.g. RASTER_PRODUCTS=precip_acc,winds10m,t_v_pres
+if 'RASTER_PRODUCTS' in os.environ:
+    raster_products = [p for p in os.environ['RASTER_PRODUCTS'].split(',') if p]
+else:
+    raster_products = []
+
+# Forecast hours to render, e.g. PLOT_STEPS=3,6,9 when the steps are rendered
+# as soon as they are published (see watcher.py). All of them if not set.
+if 'PLOT_STEPS' in os.environ:
+    plot_steps = [int(s) for s in os.environ['PLOT_STEPS'].split(',') if s]
+else:
+    plot_steps = []
+
 if "HOME_FOLDER" in os.environ:
     home_folder = os.environ['HOME_FOLDER']
 else:
@@ -50,6 +134,22 @@ options_savefig = {
 
 }
 
+# Run-level statistics written by compute_stats.py
+run_stats_file = folder + 'run_stats.json'
+# Catalogue of the variables in the GRIB files of the run (see read_dataset)
+catalogue_file = folder + 'catalogue.json'
+# Decoded fields of the run at several resolutions (see ingest.py)
+decoded_store_file = folder + 'decoded.zarr'
+
+# Write the messages and the frames drawn as JSON events to events.jsonl
+# in the folder of the run (see events.py)
+if 'EVENT_LOG' in os.environ:
+    event_log = os.environ['EVENT_LOG'].lower() in ['1', 'true', 'yes']
+else:
+    event_log = False
+if event_log:
+    events.configure(folder + 'events.jsonl', run=run_id, script=os.path.basename(sys.argv[0]))
+
 # Dictionary to map the output folder based on the projection employed
 subfolder_images = {
     'nh': folder_images,
@@ -64,6 +164,54 @@ subfolder_images = {
 }
 
 
+def configure(environ):
+    """Apply the settings read above from the environment for another one,
+    without importing the module again: the jobs of the render daemon (see
+    render_daemon.run_job) run with the environment of their client in a
+    process that imported everything while warming up"""
+    global apiKey, folder, base_folder, run_id, published_folder, folder_images, \
+        contour_cache, fast_labels, profile_frames, decoded_store, archive_runs, \
+        archive_max_days, archive_max_gb, streaming, streaming_window, animation_formats, \
+        raster_products, plot_steps, run_stats_file, catalogue_file, decoded_store_file, event_log
+
+    def flag(name):
+        return environ.get(name, '').lower() in ['1', 'true', 'yes']
+
+    def items(name):
+        return [item for item in environ.get(name, '').split(',') if item]
+
+    apiKey = environ.get('MAPBOX_KEY', apiKey)
+    base_folder = environ.get('MODEL_DATA_FOLDER', base_folder)
+    run_id = environ.get('RUN_ID')
+    published_folder = base_folder + 'published/'
+    folder = base_folder + 'runs/%s/' % run_id if run_id else base_folder
+    folder_images = folder + 'images/' if run_id else folder
+    for projection in subfolder_images:
+        subfolder_images[projection] = folder_images + \
+            ('' if projection in ['nh', 'mexico'] else projection)
+    contour_cache = flag('CONTOUR_CACHE')
+    fast_labels = flag('FAST_LABELS')
+    profile_frames = flag('PROFILE_FRAMES')
+    decoded_store = flag('DECODED_STORE')
+    archive_runs = int(environ.get('ARCHIVE_RUNS', 4))
+    archive_max_days = int(environ.get('ARCHIVE_MAX_DAYS', 3))
+    archive_max_gb = float(environ.get('ARCHIVE_MAX_GB', 20))
+    streaming = flag('STREAMING')
+    streaming_window = int(environ.get('STREAMING_WINDOW', 1))
+    if streaming:
+        import dask
+        dask.config.set(scheduler='synchronous')
+    animation_formats = items('ANIMATION_OUTPUT')
+    raster_products = items('RASTER_PRODUCTS')
+    plot_steps = [int(step) for step in items('PLOT_STEPS')]
+    run_stats_file = folder + 'run_stats.json'
+    catalogue_file = folder + 'catalogue.json'
+    decoded_store_file = folder + 'decoded.zarr'
+    event_log = flag('EVENT_LOG')
+    events.configure(folder + 'events.jsonl' if event_log else None,
+                     run=run_id, script=os.path.basename(sys.argv[0]))
+
+
 proj_defs = {
     'nh':
     {
@@ -144,58 +292,206 @@ proj_defs = {
 }
 
 
-def read_dataset(variables=['T_2M', 'TD_2M'], level=None,
-                 engine='scipy', projection=None, remapped=False):
-    """Wrapper to initialize the dataset"""
-    # Create the regex for the files with the needed variables
-    variables_search = '('+'|'.join(variables)+')'
-    # Get a list of all the files in the folder
-    # In the future we can use Run/Date to have a more selective glob pattern
+def catalogue_entries(filename):
+    """Catalogue entries of all the variables contained in a GRIB file.
+    If the file has a message index (see grib_index.py) the entries are built
+    from it, otherwise the file is scanned with cfgrib."""
+    import cfgrib
+    import grib_index
+    entries = {}
+    index = grib_index.load_index(filename)
+    if index is not None:
+        steps = {}
+        for key in index['messages']:
+            variable, step = key.rsplit('/', 1)
+            steps.setdefault(variable, []).append(int(step))
+        for variable, info in index['variables'].items():
+            key = info['name'] if info['typeOfLevel'] != 'isobaricInhPa' \
+                else '%s_%d' % (info['name'], info['level'])
+            entries[key] = {
+                'file': os.path.basename(filename),
+                'name': info['name'],
+                'filter_by_keys': {'shortName': info['shortName'],
+                                   'typeOfLevel': info['typeOfLevel'],
+                                   'level': float(info['level'])},
+                'run': info['run'],
+                'steps': sorted(steps[variable]),
+            }
+        return entries
+
+    for ds in cfgrib.open_datasets(filename):
+        for name, var in ds.data_vars.items():
+            type_of_level = var.attrs['GRIB_typeOfLevel']
+            level = float(ds[type_of_level].values) if type_of_level in ds.coords else 0.
+            # Variables on pressure levels are identified by their level, e.g. t_850
+            key = name if type_of_level != 'isobaricInhPa' else '%s_%d' % (name, level)
+            entries[key] = {
+                'file': os.path.basename(filename),
+                'name': name,
+                'filter_by_keys': {'shortName': var.attrs['GRIB_shortName'],
+                                   'typeOfLevel': type_of_level,
+                                   'level': level},
+                'run': pd.to_datetime(ds['time'].values).strftime('%Y%m%d%H'),
+                'steps': (np.atleast_1d(ds['step'].values) / pd.Timedelta('1 hour')).astype(int).tolist(),
+            }
+    return entries
+
+
+def build_catalogue():
+    """Scan all the GRIB files of the run once, in parallel, and write a catalogue
+    mapping every variable (and level) to the file that contains it, the keys to
+    filter it and the available steps. The files' size and modification time are
+    stored as well so that a stale catalogue is detected."""
+    from concurrent.futures import ThreadPoolExecutor
+    files = sorted(glob(folder + 'vars_*.grib2'))
+    catalogue = {'files': {os.path.basename(f): [os.path.getsize(f), os.path.getmtime(f)]
+                           for f in files},
+                 'variables': {}}
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        for entries in executor.map(catalogue_entries, files):
+            catalogue['variables'].update(entries)
+
+    tmp_filename = catalogue_file + '.%d.tmp' % os.getpid()
+    with open(tmp_filename, 'w') as f:
+        json.dump(catalogue, f, indent=1)
+    os.replace(tmp_filename, catalogue_file)
+
+    return catalogue
+
+
+def get_catalogue():
+    """Read the catalogue of the run, (re)building it if it's missing
+    or if the files changed since it was written"""
+    if os.path.isfile(catalogue_file):
+        with open(catalogue_file, 'r') as f:
+            catalogue = json.load(f)
+        files = sorted(glob(folder + 'vars_*.grib2'))
+        if catalogue['files'] == {os.path.basename(f): [os.path.getsize(f), os.path.getmtime(f)]
+                                  for f in files}:
+            return catalogue
+
+    return build_catalogue()
+
+
+def read_dataset(variables=['msl'], lazy=None, level=0, all_steps=False):
+    """Open the variables (names from the catalogue, e.g. 'msl', 'u10', 't_850')
+    and merge them in a single dataset. Finding the files is a lookup in the catalogue
+    and the files are opened in parallel.
+    If lazy (by default in streaming mode) the data is backed by dask: the dataset
+    sent to the Pool workers only references the files, and every worker reads
+    the steps it needs instead of receiving the arrays pickled by the main process.
+    With the decoded store the variables are read from there at the resolution
+    level (see ingest.py and get_pyramid_level).
+    If plot_steps is set only those steps are returned, unless all_steps
+    (e.g. to difference the steps before selecting them, see select_plot_steps)."""
+    from concurrent.futures import ThreadPoolExecutor
+    if lazy is None:
+        lazy = streaming
+    catalogue = get_catalogue()
+    entries = [catalogue['variables'][variable] for variable in variables]
+    names = [entry['name'] for entry in entries]
+
+    dset = read_decoded_store(variables, names, entries, lazy, level, all_steps)
+    if dset is not None:
+        return dset
+
+    def open_entry(args):
+        variable, entry = args
+        ds = xr.open_dataset(folder + entry['file'], engine='cfgrib',
+                             backend_kwargs={'filter_by_keys': entry['filter_by_keys']},
+                             chunks=streaming_chunks() if lazy else None)
+        # A file with a single step (e.g. the first one published) has no step dimension
+        if ds['step'].ndim == 0:
+            ds = ds.expand_dims('step')
+            ds = ds.assign_coords(valid_time=ds['valid_time'].expand_dims('step'))
+        # Drop the scalar level coordinates, which differ between the files
+        ds = ds.drop_vars([c for c in ds.coords if ds[c].ndim == 0 and c != 'time'])
+        # Keep the GRIB names (e.g. 't', 'gh') unless the same one is requested at two levels
+        if names.count(entry['name']) > 1:
+            ds = ds.rename({entry['name']: variable})
+        return ds
+
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        dsets = list(executor.map(open_entry, zip(variables, entries)))
+    dset = xr.merge(dsets, compat='override')
+
+    return dset if all_steps else select_plot_steps(dset)
+
+
+def select_plot_steps(dset):
+    """Only the steps of plot_steps, if set"""
+    if plot_steps:
+        dset = dset.sel(step=dset['step'].isin(pd.to_timedelta(plot_steps, unit='h')))
 
-    if remapped:
-        files = glob(folder + 'remap/*.nc')
-    else:
-        files = glob(folder + '*.nc')
+    return dset
 
-    run = pd.to_datetime(re.findall(r'(?:\d{10})', files[0])[0],
-                         format='%Y%m%d%H')
 
-    # find only the files with the variables that we need
-    needed_files = [f for f in files if re.search(
-        r'/%s(?:_\d{10})' % variables_search, f)]
-    if remapped:
-        chunks = {'time': 2, 'lon': 100, 'lat': 100}
+def read_decoded_store(variables, names, entries, lazy, level, all_steps=False):
+    """The variables from the decoded store, or None if it's not enabled or
+    doesn't contain all the steps to plot yet"""
+    if not decoded_store or not os.path.isdir(decoded_store_file):
+        return None
+    dset = xr.open_dataset(decoded_store_file, engine='zarr', group='level_%d' % level,
+                           chunks=streaming_chunks() if lazy else None)
+    steps = set((dset['step'].values / pd.Timedelta('1 hour')).astype(int))
+    wanted = set(plot_steps) if plot_steps and not all_steps else set(entries[0]['steps'])
+    if dset.attrs.get('run') != entries[0]['run'] or not wanted <= steps or \
+            not all(variable in dset for variable in variables):
+        print_message('The decoded store is not complete, reading the GRIB files')
+        return None
+    # Same names as the datasets read from the GRIB files
+    dset = dset[variables].rename({variable: name for variable, name in zip(variables, names)
+                                   if names.count(name) == 1})
+
+    return dset if all_steps else select_plot_steps(dset)
+
+
+def get_pyramid_level(projection, width):
+    """Coarsest level of the decoded store at which the grid points are at most
+    pyramid_max_spacing pixels apart (median over the area) on the map of
+    projection, width pixels wide. 0 (the original grid) without the store."""
+    if not decoded_store or not os.path.isdir(decoded_store_file):
+        return 0
+    import ingest
+    dset = xr.open_dataset(decoded_store_file, engine='zarr', group='level_0')
+    # Every stride points is enough to measure the spacing
+    stride = 8
+    lon, lat = np.meshgrid(dset['longitude'].values[::stride], dset['latitude'].values[::stride])
+    m = get_basemap(projection)
+    x, y = m(lon, lat)
+    inside = (x >= m.xmin) & (x <= m.xmax) & (y >= m.ymin) & (y <= m.ymax)
+    spacing = np.concatenate([
+        np.hypot(np.diff(x, axis=1), np.diff(y, axis=1))[inside[:, 1:] & inside[:, :-1]],
+        np.hypot(np.diff(x, axis=0), np.diff(y, axis=0))[inside[1:, :] & inside[:-1, :]]])
+    if spacing.size == 0:
+        return 0
+    spacing = np.median(spacing) / stride * width / (m.xmax - m.xmin)
+    level = 0
+    for i, factor in enumerate(ingest.pyramid_factors):
+        if spacing * factor <= pyramid_max_spacing:
+            level = i
+
+    return level
+
+
+def read_field(variable, step):
+    """Read a single step (in hours) of variable (name from the catalogue).
+    With the message index only the bytes of that GRIB message are read,
+    otherwise the file is opened with cfgrib and the step selected."""
+    import grib_index
+    entry = get_catalogue()['variables'][variable]
+    filename = folder + entry['file']
+    index = grib_index.load_index(filename)
+    if index is not None:
+        keys = entry['filter_by_keys']
+        field = grib_index.read_field(filename, keys['shortName'], keys['typeOfLevel'],
+                                      int(keys['level']), step, index=index)
     else:
-        chunks = {'time': 10, 'ncells': 1000}
-
-    dset = xr.open_mfdataset(needed_files,
-                             preprocess=preprocess,
-                             chunks=chunks,
-                             engine=engine)
-    # NOTE!! Even though we use open_mfdataset, which creates a Dask array, we then
-    # load the dataset into memory since otherwise the object cannot be pickled by
-    # multiprocessing
-    dset = dset.metpy.parse_cf()
-    if level:
-        dset = dset.sel(plev=level, method='nearest').squeeze()
-
-    if projection and (projection not in ['nh', 'world', 'us', 'nh_polar', 'nh_shift']):
-        proj_options = proj_defs[projection]
-        if remapped:
-            dset = dset.sel(lat=slice(proj_options['llcrnrlat'],
-                                      proj_options['urcrnrlat']),
-                            lon=slice(proj_options['llcrnrlon'],
-                                      proj_options['urcrnrlon']))
-        else:
-            mask = ((dset['lon'] <= proj_options['urcrnrlon']) &
-                    (dset['lon'] >= proj_options['llcrnrlon']) &
-                    (dset['lat'] <= proj_options['urcrnrlat']) &
-                    (dset['lat'] >= proj_options['llcrnrlat']))
-            dset = dset.where(mask, drop=True)
+        field = xr.open_dataset(filename, engine='cfgrib',
+                                backend_kwargs={'filter_by_keys': entry['filter_by_keys']}
+                                )[entry['name']].sel(step=pd.Timedelta(hours=step)).load()
 
-    dset.attrs['run'] = run
-
-    return dset
+    return field.rename(entry['name'])
 
 
 def get_time_run_cum(dset):
@@ -207,20 +503,11 @@ def get_time_run_cum(dset):
     return time, run, cum_hour
 
 
-def preprocess(ds):
-    '''Additional preprocessing step to apply to the datasets'''
-    # correct gust attributes typo
-    if 'VMAX_10M' in ds.variables.keys():
-        ds['VMAX_10M'].attrs['units'] = 'm/s'
-    if 'plev_bnds' in ds.variables.keys():
-        ds = ds.drop('plev_bnds')
-
-    return ds.squeeze(drop=True)
-
-
-def print_message(message):
-    """Formatted print"""
+def print_message(message, **fields):
+    """Formatted print, also written to the event log with fields
+    (e.g. step, stage, duration) when enabled, see events.py"""
     print(os.path.basename(sys.argv[0])+' : '+message)
+    events.log(message, **fields)
 
 
 def get_coordinates(ds):
@@ -278,13 +565,71 @@ def get_city_coordinates(city):
         return lon, lat
 
 
+# Basemap instances already built in this process, by projection (see get_basemap)
+basemaps = {}
+# Colormap tables already read in this process, by file name (see read_rgba)
+rgba_tables = {}
+
+
+# Figures of the products set up in this process, by (projection, variable_name)
+figures = {}
+# Empty figures (with their axes) built in advance by projection, e.g. by the
+# render daemon, and taken by new_figure
+warm_figures = {}
+
+
+def new_figure(projection, variable_name):
+    """Create the figure of a product and keep it, with its axes, for the whole process.
+    The scripts set up the map on it in main() before forking the Pool, so every worker
+    inherits it already initialised and reuses it for all the steps it's given, instead
+    of receiving a pickled copy of it with every chunk. The colorbar is added to it by
+    each worker the first time it draws (see get_figure).
+    If a figure of the projection was built in advance (see warm_figures) that one is used."""
+    import matplotlib.pyplot as plt
+    if projection in warm_figures:
+        figures[(projection, variable_name)] = warm_figures.pop(projection)
+        # Current figure of pyplot, as a new one would be (plt.colorbar, plt.savefig)
+        plt.figure(figures[(projection, variable_name)]['fig'].number)
+    else:
+        fig = plt.figure(figsize=(figsize_x, figsize_y))
+        figures[(projection, variable_name)] = {'fig': fig, 'ax': plt.gca()}
+
+    return figures[(projection, variable_name)]
+
+
+def get_figure(projection, variable_name):
+    """Figure of a product created by new_figure: a dictionary with 'fig', 'ax'
+    and whatever has been added to it, e.g. 'm' and 'colorbar'"""
+    return figures[(projection, variable_name)]
+
+
+def get_basemap(projection):
+    """Basemap instance of projection. Building it (and clipping the coastlines
+    to the domain) is the slow part, so the instance is kept and reused by all
+    the figures of the process, e.g. by the workers of the render daemon."""
+    from mpl_toolkits.basemap import Basemap
+    if projection not in basemaps:
+        basemaps[projection] = Basemap(**proj_defs[projection])
+
+    return basemaps[projection]
+
+
+def read_rgba(name):
+    """Colours of the colormap file cmap_<name>.rgba, read only once per process"""
+    if name not in rgba_tables:
+        rgba_tables[name] = pd.read_csv(home_folder + '/plotting/cmap_%s.rgba' % name).values
+
+    return rgba_tables[name]
+
+
 def get_projection(dset, projection="nh", countries=True, regions=False,
                    labels=False):
-    from mpl_toolkits.basemap import Basemap
     """Create the projection in Basemap and returns the x, y array to use it in a plot"""
     lon, lat = get_coordinates(dset)
-    proj_options = proj_defs[projection]
-    m = Basemap(**proj_options)
+    m = get_basemap(projection)
+    # The map boundary drawn on the figure of another product, which basemap
+    # would otherwise use to clip the coastlines of this one
+    m._mapboundarydrawn = False
     m.drawcoastlines(linewidth=0.5, linestyle='solid', color='black', zorder=8)
 
     if projection == "us":
@@ -338,6 +683,120 @@ def get_projection(dset, projection="nh", countries=True, regions=False,
     return m, x, y, mask
 
 
+def streaming_chunks():
+    """Chunks to pass to xr.open_dataset to read lazily (by default only in
+    streaming mode): the data is backed by dask with streaming_window steps
+    per chunk."""
+    return {'step': streaming_window}
+
+
+def compute_minmax(var):
+    """Min and max of var. If var is backed by dask both are reduced in a single
+    pass that reads one chunk at a time, so that the whole run is never in memory."""
+    vmin, vmax = var.min(), var.max()
+    if var.chunks is not None:
+        import dask
+        vmin, vmax = dask.compute(vmin, vmax)
+
+    return float(vmin), float(vmax)
+
+
+def print_peak_rss():
+    """Print the peak resident memory of this process and of its largest child
+    (i.e. the Pool workers)"""
+    import resource
+    # ru_maxrss is in kilobytes on Linux
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+    print_message('peak RSS %.0f MB (main), %.0f MB (largest worker)' %
+                  (rss_self, rss_children))
+
+
+def get_domain_mask(lon, lat, projection):
+    """Boolean mask of the grid points that fall inside the map
+    of projection, without drawing anything"""
+    from mpl_toolkits.basemap import Basemap
+    # No need to load the coastlines just to transform the coordinates
+    m = Basemap(**dict(proj_defs[projection], resolution=None))
+    x, y = m(lon, lat)
+
+    return (x >= m.xmin) & (x <= m.xmax) & (y >= m.ymin) & (y <= m.ymax)
+
+
+def read_run_stats():
+    """Read the run statistics written by compute_stats.py, None if not available"""
+    if not os.path.isfile(run_stats_file):
+        return None
+    with open(run_stats_file, 'r') as f:
+        return json.load(f)
+
+
+def get_levels_from_stats(name, step, var, domain='global'):
+    """Contour levels spaced by step between the min and max of the variable
+    name over the whole run. These are read from the run statistics so that they're
+    the same for every projection; if the statistics are missing or belong to
+    another run they're computed from var (a DataArray on the full grid).
+    The levels are multiples of step, so that when the range grows (e.g. the
+    statistics of a run being published, see watcher.py) the levels are only
+    added at the ends and the steps already drawn don't change."""
+    stats = read_run_stats()
+    run = pd.to_datetime(var['time'].values).strftime('%Y%m%d%H')
+    if stats and stats.get('run') == run and domain in stats['variables'].get(name, {}):
+        vmin = stats['variables'][name][domain]['min']
+        vmax = stats['variables'][name][domain]['max']
+    else:
+        print_message('No run statistics for %s, computing them from the data' % name)
+        vmin, vmax = compute_minmax(var)
+
+    return np.arange(np.floor(vmin / step) * step, vmax, step)
+
+
+def save_figure(filename):
+    """Save the current figure to filename. If animated outputs are requested
+    the PNG is rendered in memory and its bytes are also returned, so that the
+    frames can be assembled without reading them again from disk."""
+    import matplotlib.pyplot as plt
+    if not animation_formats:
+        plt.savefig(filename, **options_savefig)
+        return None
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', **options_savefig)
+    with open(filename, 'wb') as f:
+        f.write(buffer.getvalue())
+
+    return buffer.getvalue()
+
+
+def product_folder(projection, variable_name):
+    """Folder where the images of a product are written. In the run-scoped layout
+    every product has its own folder, images/<projection>/<variable_name>,
+    so that it can be published as a whole once it's complete."""
+    if not run_id:
+        return subfolder_images[projection]
+    path = folder_images + '%s/%s' % (projection, variable_name)
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def publish(path, name):
+    """Point published/<name> to path. The symlink is created aside and then
+    renamed over the old one, so that readers see either the previous
+    target or the new one, never a missing or partial folder."""
+    link = published_folder + name
+    os.makedirs(os.path.dirname(link), exist_ok=True)
+    tmp_link = link + '.%d.tmp' % os.getpid()
+    os.symlink(os.path.abspath(path), tmp_link)
+    os.replace(tmp_link, link)
+
+
+def publish_product(projection, variable_name):
+    """Publish the images of this run for a product, only in the run-scoped layout"""
+    if run_id:
+        publish(product_folder(projection, variable_name),
+                '%s/%s' % (projection, variable_name))
+
+
 def chunks_dataset(ds, n):
     """Same as 'chunks' but for the time dimension in
     a dataset"""
@@ -404,8 +863,7 @@ def truncate_colormap(cmap, minval=0.0, maxval=1.0, n=256):
 
 def get_colormap(cmap_type):
     """Create a custom colormap."""
-    colors_tuple = pd.read_csv(
-        home_folder + '/plotting/cmap_%s.rgba' % cmap_type).values
+    colors_tuple = read_rgba(cmap_type)
 
     cmap = colors.LinearSegmentedColormap.from_list(
         cmap_type, colors_tuple, colors_tuple.shape[0])
@@ -428,27 +886,23 @@ def get_colormap_norm(cmap_type, levels):
         cmap, norm = from_levels_and_colors(levels, sns.color_palette('gist_stern_r', n_colors=len(levels)),
                                             extend='max')
     elif cmap_type == "rain_new":
-        colors_tuple = pd.read_csv(
-            home_folder + '/plotting/cmap_prec.rgba').values
+        colors_tuple = read_rgba('prec')
         cmap, norm = from_levels_and_colors(levels, sns.color_palette(colors_tuple, n_colors=len(levels)),
                                             extend='max')
     elif cmap_type == "winds":
-        colors_tuple = pd.read_csv(
-            home_folder + '/plotting/cmap_winds.rgba').values
+        colors_tuple = read_rgba('winds')
         cmap, norm = from_levels_and_colors(levels, sns.color_palette(colors_tuple, n_colors=len(levels)),
                                             extend='max')
     elif cmap_type == "rain_acc_wxcharts":
-        colors_tuple = pd.read_csv(
-            home_folder + '/plotting/cmap_rain_acc_wxcharts.rgba').values
+        colors_tuple = read_rgba('rain_acc_wxcharts')
         cmap, norm = from_levels_and_colors(levels, sns.color_palette(colors_tuple, n_colors=len(levels)),
                                             extend='max')
     elif cmap_type == "snow_wxcharts":
-        colors_tuple = pd.read_csv(
-            home_folder + '/plotting/cmap_snow_wxcharts.rgba').values
+        colors_tuple = read_rgba('snow_wxcharts')
         cmap, norm = from_levels_and_colors(levels, sns.color_palette(colors_tuple, n_colors=len(levels)),
                                             extend='max')
     elif cmap_type == "winds_wxcharts":
-        colors_tuple = pd.read_csv(home_folder + '/plotting/cmap_winds_wxcharts.rgba').values    
+        colors_tuple = read_rgba('winds_wxcharts')
         cmap, norm = from_levels_and_colors(levels, sns.color_palette(colors_tuple, n_colors=len(levels)),
                          extend='max')
 
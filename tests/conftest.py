@@ -0,0 +1,10 @@
+"""The modules of plotting/ are imported as in the scripts, with the data
+folder in a temporary directory unless MODEL_DATA_FOLDER is set"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('MAPBOX_KEY', '')
+os.environ.setdefault('MODEL_DATA_FOLDER', tempfile.mkdtemp() + '/')
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, 'plotting')]
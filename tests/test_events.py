@@ -0,0 +1,9 @@
+"""Metrics in the Prometheus text format (events.format_metric)"""
+import events
+
+
+def test_label_values_escaped():
+    lines = events.format_metric('tasks', 'gauge', 'Tasks', [({'task': 'a\\b "c"\nd'}, 2)])
+    assert lines[-1] == 'ecmwf_hres_tasks{task="a\\\\b \\"c\\"\\nd"} 2.0'
+    # A single line per sample
+    assert len(lines) == 3
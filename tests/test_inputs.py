@@ -0,0 +1,22 @@
+"""The inputs declared in inputs.py, read by download_data.py without the plotting modules"""
+import os
+import subprocess
+import sys
+import inputs
+import products
+
+
+def test_every_product_is_declared():
+    assert set(inputs.product_inputs) == set(products.products)
+    for product, spec in products.products.items():
+        assert spec['inputs'] == inputs.product_inputs[product]
+
+
+def test_download_without_plotting_modules(tmp_path):
+    """download_data only needs the data folder, not the settings of utils"""
+    code = ('import sys, download_data; download_data.required_variables(); '
+            'assert not {"utils", "matplotlib", "metpy"} & set(sys.modules), sorted(sys.modules)')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(inputs.__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                            env={'MODEL_DATA_FOLDER': str(tmp_path) + '/'})
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,53 @@
+"""Interval accumulations of tp (computations.interval_steps and interval_accumulations)"""
+import numpy as np
+import xarray as xr
+from computations import interval_steps, interval_accumulations
+
+# Steps of a 00/12 run around the change of cadence at +144h
+steps = list(range(3, 145, 3)) + list(range(150, 241, 6))
+
+
+def accumulated(step):
+    """tp accumulated from the start of the run, 1 mm/h until +144h and 2 mm/h after"""
+    value = step if step <= 144 else 144 + 2 * (step - 144)
+    return xr.DataArray(np.full((2, 3), value, dtype=np.float32), dims=('latitude', 'longitude'),
+                        name='tp', attrs={'units': 'mm'})
+
+
+def test_interval_steps_follow_the_cadence():
+    intervals = interval_steps(steps, 3)
+    assert intervals[:2] == [(0, 3), (3, 6)]
+    # Every 6 hours after +144h
+    assert [i for i in intervals if i[0] >= 141][:3] == [(141, 144), (144, 150), (150, 156)]
+    assert interval_steps(steps, 24)[-2:] == [(192, 216), (216, 240)]
+    assert all(end - start == 6 for start, end in interval_steps(steps, 6))
+
+
+def test_accumulation_and_rate():
+    reads = []
+
+    def read_field(step):
+        reads.append(step)
+        return accumulated(step)
+    results = list(interval_accumulations(read_field, interval_steps(steps, 6)))
+    # Every step is read once and the step 0 is never read
+    assert reads == sorted(set(reads)) and 0 not in reads
+    for start, end, accumulation, rate in results:
+        expected = 1. if end <= 144 else 2.
+        np.testing.assert_allclose(accumulation, expected * (end - start))
+        np.testing.assert_allclose(rate, expected)
+        assert accumulation.name == 'tp' and rate.name == 'tp_rate'
+        assert rate.attrs['units'] == 'mm/h'
+
+
+def test_intervals_of_a_chunk():
+    """A chunk starting in the middle of the run reads the start of its first interval"""
+    reads = []
+
+    def read_field(step):
+        reads.append(step)
+        return accumulated(step)
+    intervals = [(138, 144), (144, 150)]
+    results = list(interval_accumulations(read_field, intervals))
+    assert reads == [138, 144, 150]
+    np.testing.assert_allclose(results[1][2], 12.)
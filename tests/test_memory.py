@@ -0,0 +1,54 @@
+"""Memory estimates of the render tasks (compute_stats.estimate_memory) and
+their admission under a budget (orchestrator.run_graph)"""
+import threading
+import time
+import compute_stats
+import orchestrator
+import utils
+
+# Points of the 0.25 degrees grid, of the world map and of a small domain
+grid_points = 1440 * 721
+world_points = grid_points
+small_points = 120 * 80
+
+
+def test_estimates_scale_with_domain_and_steps(monkeypatch):
+    monkeypatch.setattr(utils, 'streaming', False)
+    world = compute_stats.estimate_memory(3, grid_points, world_points, 65)
+    small = compute_stats.estimate_memory(3, grid_points, small_points, 8)
+    assert world > 4 * small
+    # More steps or a larger domain, more memory
+    assert compute_stats.estimate_memory(3, grid_points, small_points, 65) > small
+    assert compute_stats.estimate_memory(3, grid_points, world_points, 8) > small
+    # The data, not the processes, makes most of a large task
+    assert world > 4 * compute_stats.worker_memory * (utils.processes + 1)
+
+
+def test_large_tasks_serialised_under_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'streaming', False)
+    world = compute_stats.estimate_memory(3, grid_points, world_points, 65)
+    small = compute_stats.estimate_memory(3, grid_points, small_points, 8)
+    monkeypatch.setattr(orchestrator, 'memory_budget', world + small)
+    spans, lock = {}, threading.Lock()
+
+    def task(name):
+        def function():
+            start = time.time()
+            time.sleep(0.2)
+            with lock:
+                spans[name] = (start, time.time())
+        return function
+    tasks = {name: dict(stage='render', deps=[], memory=memory, function=task(name))
+             for name, memory in [('world_a', world), ('world_b', world),
+                                  ('small_a', small), ('small_b', small)]}
+
+    results = orchestrator.run_graph(tasks, {}, str(tmp_path) + '/')
+    assert all(result['status'] == 'ok' for result in results.values())
+
+    def overlap(a, b):
+        return spans[a][0] < spans[b][1] and spans[b][0] < spans[a][1]
+    # The world maps never run together, a small one runs next to one of them
+    assert not overlap('world_a', 'world_b')
+    assert overlap('world_a', 'small_a')
+    assert 'world_b' in orchestrator.admission['delayed']
+    assert orchestrator.admission['peak'] <= world + small
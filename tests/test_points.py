@@ -0,0 +1,22 @@
+"""Points of the time series (meteograms.read_points)"""
+import pytest
+import meteograms
+
+
+def test_points_from_csv_and_arguments(tmp_path):
+    filename = tmp_path / 'points.csv'
+    filename.write_text('name,lon,lat,country\nMilano,9.19,45.46,IT\nHamburg,9.99,53.55,DE\n')
+    points = meteograms.read_points([str(filename)])
+    assert list(points.columns) == ['name', 'lon', 'lat']
+    assert list(points['name']) == ['Milano', 'Hamburg']
+    points = meteograms.read_points(['7.6,45.1', '9.19,45.46'])
+    assert list(points['lon']) == [7.6, 9.19]
+
+
+def test_duplicated_points_rejected(tmp_path):
+    filename = tmp_path / 'points.csv'
+    filename.write_text('name,lon,lat\nMilano,9.19,45.46\nHamburg,9.99,53.55\nMilano,9.2,45.5\n')
+    with pytest.raises(ValueError, match='Milano'):
+        meteograms.read_points([str(filename)])
+    with pytest.raises(ValueError, match='7.6,45.1'):
+        meteograms.read_points(['7.6,45.1', '9.19,45.46', '7.6,45.1'])
@@ -0,0 +1,70 @@
+"""Tolerances of the decoded store (ingest.quantisation) on synthetic fields"""
+import numpy as np
+import pytest
+import xarray as xr
+import ingest
+
+
+def synthetic(values):
+    """Dataset of a single variable with the dimensions of the store"""
+    return xr.Dataset({'field': (('step', 'latitude', 'longitude'), values.astype(np.float32))},
+                      coords={'step': [3], 'latitude': np.linspace(90, -90, values.shape[1]),
+                              'longitude': np.linspace(-180, 179, values.shape[2])})
+
+
+def roundtrip(dset, spec, path):
+    """dset written to and read back from a zarr store with the encoding of spec"""
+    ingest.quantisation['field'] = spec
+    try:
+        encoding = ingest.quantise(dset)
+    finally:
+        del ingest.quantisation['field']
+    dset.to_zarr(path, mode='w', encoding=encoding)
+
+    return xr.open_zarr(path)['field'].values
+
+
+def sample(spec, shape=(1, 40, 80)):
+    """Values spanning most of the range that a spec can store"""
+    rng = np.random.default_rng(0)
+    if 'tolerance' in spec:
+        half_range = 0.95 * 32767 * 2 * spec['tolerance']
+        return spec['offset'] + rng.uniform(-half_range, half_range, shape)
+    return rng.standard_normal(shape) * np.exp(rng.uniform(-20, 5, shape))
+
+
+@pytest.mark.parametrize('variable', sorted(ingest.quantisation))
+def test_tolerance(variable, tmp_path):
+    spec = ingest.quantisation[variable]
+    original = synthetic(sample(spec))
+    values = original['field'].values.copy()
+    stored = roundtrip(original, spec, tmp_path / 'store.zarr')
+    if 'tolerance' in spec:
+        # A little margin for the float32 arithmetic of scale and offset
+        assert np.abs(stored - values).max() <= spec['tolerance'] * (1 + 1e-3) + \
+            np.spacing(np.float32(np.abs(values).max()))
+    else:
+        relative = np.abs(stored - values) / np.abs(values)
+        assert relative.max() <= 2. ** -(spec['keepbits'] + 1)
+
+
+def test_clipping(tmp_path):
+    spec = dict(tolerance=0.5, offset=100.)
+    low, high = 100. - 32767, 100. + 32767
+    values = np.full((1, 4, 4), 100.)
+    values[0, 0, :2] = [low - 1e4, high + 1e4]
+    stored = roundtrip(synthetic(values), spec, tmp_path / 'store.zarr')
+    # Clipped to the range instead of wrapping around the int16
+    assert stored[0, 0, 0] == pytest.approx(low, abs=spec['tolerance'])
+    assert stored[0, 0, 1] == pytest.approx(high, abs=spec['tolerance'])
+    assert np.abs(stored[0, 1:] - 100.).max() <= spec['tolerance']
+
+
+def test_bitround():
+    values = np.array([0., 1., -1., np.pi, 1e-30, -3e30, np.nan], dtype=np.float32)
+    rounded = ingest.bitround(values, 7)
+    finite = np.isfinite(values) & (values != 0)
+    assert (np.abs(rounded[finite] - values[finite]) / np.abs(values[finite]) <= 2. ** -8).all()
+    assert rounded[0] == 0. and np.isnan(rounded[-1])
+    # Already rounded values don't change
+    np.testing.assert_array_equal(ingest.bitround(rounded, 7), rounded)
@@ -0,0 +1,36 @@
+"""Settings of the jobs of the render daemon (utils.configure)"""
+import json
+import subprocess
+import sys
+import utils
+
+settings = ['apiKey', 'folder', 'base_folder', 'run_id', 'published_folder', 'folder_images',
+            'contour_cache', 'fast_labels', 'profile_frames', 'decoded_store', 'archive_runs',
+            'archive_max_days', 'archive_max_gb', 'streaming', 'streaming_window',
+            'animation_formats', 'raster_products', 'plot_steps', 'run_stats_file',
+            'catalogue_file', 'decoded_store_file', 'event_log', 'subfolder_images']
+
+
+def imported_settings(env):
+    """The settings of utils imported with env, in a new interpreter"""
+    code = 'import json, utils; print(json.dumps({s: getattr(utils, s) for s in %r}))' % settings
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                            cwd=utils.home_folder + '/plotting', check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_configure_matches_import(tmp_path, monkeypatch):
+    env = {'MAPBOX_KEY': 'key', 'MODEL_DATA_FOLDER': str(tmp_path) + '/', 'RUN_ID': '2026101912',
+           'PLOT_STEPS': '3,6', 'STREAMING': 'true', 'STREAMING_WINDOW': '2', 'DECODED_STORE': 'yes',
+           'RASTER_PRODUCTS': 'precip_acc,winds10m', 'ANIMATION_OUTPUT': 'webp', 'FAST_LABELS': '1',
+           'ARCHIVE_RUNS': '0', 'PATH': '/usr/bin:/bin'}
+    for setting in settings:
+        value = getattr(utils, setting)
+        monkeypatch.setattr(utils, setting, dict(value) if isinstance(value, dict) else value)
+    utils.configure(env)
+    assert json.loads(json.dumps({s: getattr(utils, s) for s in settings})) == imported_settings(env)
+
+    # And back to a job without the toggles
+    env = {'MAPBOX_KEY': 'key', 'MODEL_DATA_FOLDER': str(tmp_path) + '/', 'PATH': '/usr/bin:/bin'}
+    utils.configure(env)
+    assert json.loads(json.dumps({s: getattr(utils, s) for s in settings})) == imported_settings(env)
@@ -0,0 +1,154 @@
+"""Polling and downloading of a run being published (watcher.py), against a
+local server with the layout of the open data"""
+from datetime import datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import numpy as np
+import pytest
+import download_data
+import watcher
+
+run = datetime(2026, 10, 19, 0)
+params = {'msl': ('meanSea', 0, 101300.), '2t': ('heightAboveGround', 2, 288.)}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Serve tmp_path/server and use it as OPENDATA_SOURCE, returning the folder
+    where the steps are published"""
+    root = tmp_path / 'server'
+    folder = root / run.strftime('%Y%m%d/%Hz/ifs/0p25/oper')
+    folder.mkdir(parents=True)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(root)))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(download_data, 'source', 'http://127.0.0.1:%d' % httpd.server_address[1])
+    # A single request with the parameters of the published files
+    monkeypatch.setattr(download_data, 'required_variables', lambda: ['msl', 't2m'])
+    yield folder
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def publish(folder, step):
+    """Write the GRIB file of a step and its index, as on the open data server:
+    one message per parameter with value + step everywhere"""
+    import eccodes
+    basename = folder / run.strftime('%Y%m%d%H0000-{}h-oper-fc'.format(step))
+    offset = 0
+    with open(str(basename) + '.grib2', 'wb') as grib, open(str(basename) + '.index', 'w') as index:
+        for param, (type_of_level, level, value) in params.items():
+            gid = eccodes.codes_grib_new_from_samples('regular_ll_sfc_grib2')
+            eccodes.codes_set(gid, 'dataDate', int(run.strftime('%Y%m%d')))
+            eccodes.codes_set(gid, 'dataTime', run.hour * 100)
+            eccodes.codes_set(gid, 'typeOfLevel', type_of_level)
+            eccodes.codes_set(gid, 'level', level)
+            eccodes.codes_set(gid, 'shortName', param)
+            eccodes.codes_set(gid, 'stepUnits', 1)
+            eccodes.codes_set(gid, 'step', step)
+            values = eccodes.codes_get_values(gid)
+            eccodes.codes_set_values(gid, np.full(values.shape, value + step))
+            message = eccodes.codes_get_message(gid)
+            eccodes.codes_release(gid)
+            grib.write(message)
+            index.write(json.dumps({'date': run.strftime('%Y%m%d'), 'time': run.strftime('%H%M'),
+                                    'step': str(step), 'type': 'fc', 'stream': 'oper',
+                                    'levtype': 'sfc', 'param': param,
+                                    '_offset': offset, '_length': len(message)}) + '\n')
+            offset += len(message)
+
+
+def test_available_steps_stops_at_first_missing(server):
+    for step in [3, 6, 12]:
+        publish(server, step)
+    steps, published = watcher.available_steps(run, [3, 6, 9, 12])
+    assert steps == [3, 6]
+    # From the Last-Modified of the server
+    assert published == pytest.approx(os.path.getmtime(server / '20261019000000-3h-oper-fc.index'), abs=1)
+
+
+def test_available_steps_batch_size(server, monkeypatch):
+    monkeypatch.setattr(watcher, 'batch_size', 2)
+    for step in [3, 6, 9]:
+        publish(server, step)
+    assert watcher.available_steps(run, [3, 6, 9])[0] == [3, 6]
+    assert watcher.available_steps(run, [9])[0] == [9]
+
+
+def test_available_steps_nothing_published(server):
+    assert watcher.available_steps(run, [3, 6]) == ([], None)
+
+
+def test_download_append(server, tmp_path):
+    """The steps of every batch are appended to the same file and index"""
+    import grib_index
+    folder = tmp_path / 'run'
+    folder.mkdir()
+    for steps in [[3, 6], [9]]:
+        for step in steps:
+            publish(server, step)
+        download_data.download('20261019', '00', steps, str(folder), append=True)
+
+    filename = str(folder / 'vars_2D.grib2')
+    assert sorted(os.listdir(folder)) == ['vars_2D.grib2', 'vars_2D.grib2' + grib_index.index_suffix]
+    index = grib_index.load_index(filename)
+    assert index is not None
+    assert sorted(index['messages']) == sorted(grib_index.message_key(param, type_of_level, level, step)
+                                               for param, (type_of_level, level, _) in params.items()
+                                               for step in [3, 6, 9])
+    for step in [3, 6, 9]:
+        field = grib_index.read_field(filename, 'msl', 'meanSea', 0, step, index)
+        np.testing.assert_allclose(field.values, 101300. + step)
+
+
+def test_main_batches(server, monkeypatch, tmp_path):
+    """Every batch is downloaded and then rendered, until all the steps are published"""
+    monkeypatch.setattr(watcher, 'batch_size', 2)
+    monkeypatch.setattr(download_data, 'get_steps', lambda time: [3, 6, 9])
+    monkeypatch.setenv('MODEL_DATA_FOLDER', str(tmp_path))
+    monkeypatch.setenv('RUN_ID', '')
+    monkeypatch.setenv('DATA_DOWNLOAD', 'true')
+    monkeypatch.setattr('sys.argv', ['watcher.py', '2026101900'])
+    for step in [3, 6, 9]:
+        publish(server, step)
+    import grib_index
+    rendered = []
+
+    def render(run, run_folder, steps, complete):
+        index = grib_index.load_index(run_folder + 'vars_2D.grib2')
+        rendered.append((steps, sorted({int(key.split('/')[-1]) for key in index['messages']}), complete))
+    monkeypatch.setattr(watcher, 'render', render)
+
+    assert watcher.main() == 0
+    # Every batch renders only its steps, with the ones before already in the file,
+    # and the last one completes the run
+    assert rendered == [([3, 6], [3, 6], False), ([9], [3, 6, 9], True)]
+    with open(tmp_path / 'runs' / '2026101900' / 'watch_report.json') as f:
+        report = json.load(f)
+    assert report['complete']
+    assert [batch['steps'] for batch in report['batches']] == [[3, 6], [9]]
+
+
+def test_levels_only_grow_with_the_run(monkeypatch):
+    """The levels from the statistics of the first batches are a subset of the
+    ones of the whole run, so the steps already published don't change"""
+    import pandas as pd
+    import xarray as xr
+    import utils
+    # The levels are computed from the fields
+    monkeypatch.setattr(utils, 'read_run_stats', lambda: None)
+
+    def field(vmin, vmax):
+        return xr.DataArray(np.linspace(vmin, vmax, 10), dims='x',
+                            coords={'time': pd.Timestamp(run)})
+    first = utils.get_levels_from_stats('msl', 5., field(987.3, 1021.8))
+    whole = utils.get_levels_from_stats('msl', 5., field(962.1, 1043.6))
+    assert set(first) <= set(whole)
+    assert first[0] == 985. and first[-1] == 1020.
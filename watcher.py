@@ -0,0 +1,146 @@
+"""Process a run while it is being published: the index of every step on the
+server is polled, the steps that appeared since the last poll are downloaded
+(appended to the files of the run) and rendered right away, without waiting
+for the whole run to be available.
+The time from the publication of the first step to the first image, and the
+latency of every batch, are written to runs/<RUN_ID>/watch_report.json.
+The statistics of the run (compute_stats.py) are computed again on every
+batch, but the contour levels only gain values at the ends of the range (see
+utils.get_levels_from_stats), so the steps already published stay valid.
+
+Usage: python watcher.py [YYYYMMDDHH]
+
+The server can be changed with OPENDATA_SOURCE, e.g. a local mirror
+OPENDATA_SOURCE=http://localhost:8000 with the same layout as the ECMWF one."""
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from glob import glob
+import json
+import os
+import sys
+import time
+import requests
+import download_data
+import orchestrator
+
+# Seconds between two polls and maximum time to wait for the whole run
+poll_interval = int(os.environ.get('WATCH_INTERVAL', 60))
+watch_timeout = int(os.environ.get('WATCH_TIMEOUT', 6 * 3600))
+# Maximum number of steps processed together, so that the first images come
+# out quickly also when the watcher starts with many steps already published
+batch_size = 8
+
+# Base URL of the known sources, any other source is used as a URL
+source_urls = {
+    'ecmwf': 'https://data.ecmwf.int/forecasts',
+}
+
+index_pattern = ("{url}/{date}/{time}z/ifs/0p25/{stream}/"
+                 "{date}{time}0000-{step}h-{stream}-fc.index")
+
+
+def index_url(run, step):
+    """URL of the index of a step, which is published together with the step"""
+    return index_pattern.format(url=source_urls.get(download_data.source, download_data.source).rstrip('/'),
+                                date=run.strftime('%Y%m%d'), time=run.strftime('%H'),
+                                # The 06/18 runs are in a different stream
+                                stream='oper' if run.hour in [0, 12] else 'scda',
+                                step=step)
+
+
+def available_steps(run, steps):
+    """Steps that are already published, in order, and the time when the first
+    one was published according to the server (or now if it doesn't say).
+    The steps are published progressively, so stop at the first one that is not there yet."""
+    available, published = [], None
+    for step in steps[:batch_size]:
+        response = requests.head(index_url(run, step), timeout=30)
+        if response.status_code != 200:
+            break
+        if published is None:
+            published = time.time()
+            if 'Last-Modified' in response.headers:
+                published = parsedate_to_datetime(response.headers['Last-Modified']).timestamp()
+        available.append(step)
+
+    return available, published
+
+
+def latest_started_run():
+    """Latest run whose first step is already published"""
+    from ecmwf.opendata import Client
+    return Client(source=download_data.source).latest(type="fc", step=3, param="msl")
+
+
+def render(run, run_folder, steps, complete):
+    """Render (and upload, if enabled) only steps, using the same task graph of
+    orchestrator.py. The run is archived only once complete, i.e. with the last batch."""
+    env = dict(os.environ, RUN_ID=run.strftime('%Y%m%d%H'), QT_QPA_PLATFORM='offscreen',
+               PLOT_STEPS=','.join(str(step) for step in steps))
+    results = orchestrator.run_graph(orchestrator.build_tasks(run, run_folder, complete), env,
+                                     run_folder + 'logs/')
+    failed = [name for name, result in results.items() if result['status'] != 'ok']
+    if failed:
+        orchestrator.print_message('%d tasks failed: %s' % (len(failed), ', '.join(failed)))
+
+
+def first_image_time(run_folder):
+    """Modification time of the oldest image of the run"""
+    images = glob(run_folder + 'images/**/*.png', recursive=True)
+
+    return min(os.path.getmtime(image) for image in images) if images else None
+
+
+def main():
+    if sys.argv[1:]:
+        run = datetime.strptime(sys.argv[1], '%Y%m%d%H')
+    else:
+        run = latest_started_run()
+    run_id = run.strftime('%Y%m%d%H')
+    os.environ['RUN_ID'] = run_id
+    # The steps are downloaded here, the graph only renders and uploads them
+    os.environ['DATA_DOWNLOAD'] = 'false'
+    run_folder = download_data.get_folder() + '/'
+    os.makedirs(run_folder + 'logs', exist_ok=True)
+    if orchestrator.toggle('EVENT_LOG', default=False):
+        orchestrator.events.configure(run_folder + 'events.jsonl', run=run_id,
+                                      script=os.path.basename(sys.argv[0]))
+    orchestrator.print_message('Watching run %s on %s' % (run_id, download_data.source))
+
+    pending = download_data.get_steps(run.strftime('%H'))
+    report = {'run': run_id, 'batches': []}
+    start = time.time()
+    while pending and time.time() - start < watch_timeout:
+        steps, published = available_steps(run, pending)
+        if not steps:
+            time.sleep(poll_interval)
+            continue
+        batch = {'steps': steps, 'published': published, 'detected': time.time()}
+        report.setdefault('first_published', published)
+        download_data.download(run.strftime('%Y%m%d'), run.strftime('%H'), steps,
+                               run_folder, append=True)
+        batch['downloaded'] = time.time()
+        pending = [step for step in pending if step not in steps]
+        render(run, run_folder, steps, complete=not pending)
+        batch['rendered'] = time.time()
+        report['batches'].append(batch)
+        orchestrator.print_message('Steps %d-%d: downloaded in %.1fs, rendered in %.1fs, %d steps left' %
+                                   (steps[0], steps[-1], batch['downloaded'] - batch['detected'],
+                                    batch['rendered'] - batch['downloaded'], len(pending)),
+                                   step=steps[-1], stage='batch',
+                                   duration=round(batch['rendered'] - batch['detected'], 3))
+        if 'time_to_first_image' not in report and first_image_time(run_folder):
+            report['time_to_first_image'] = first_image_time(run_folder) - report['first_published']
+            orchestrator.print_message('Time to first image: %.1fs' % report['time_to_first_image'])
+
+    report['complete'] = not pending
+    with open(run_folder + 'watch_report.json', 'w') as f:
+        json.dump(report, f, indent=1)
+    if pending:
+        orchestrator.print_message('Timeout, %d steps were never published' % len(pending))
+
+    return int(bool(pending))
+
+
+if __name__ == "__main__":
+    sys.exit(main())